@@ -0,0 +1,964 @@
+#!/usr/bin/env python3
+
+# Benchmarks for the kiwidata pipeline.  Each benchmark runs its candidates
+# in fresh interpreters so import and page cache effects are comparable.
+#
+#   ./kiwisdr_benchmarks.py snapshot [snapshot_file]
+#   ./kiwisdr_benchmarks.py parse [receivers]
+#   ./kiwisdr_benchmarks.py startup [wrapper]
+#   ./kiwisdr_benchmarks.py select [receivers ...]
+#   ./kiwisdr_benchmarks.py score [receivers]
+#   ./kiwisdr_benchmarks.py filter [receivers]
+#   ./kiwisdr_benchmarks.py relax [receivers [target [step [floor]]]]
+#   ./kiwisdr_benchmarks.py diverse [receivers [limit]]
+#   ./kiwisdr_benchmarks.py coverage [receivers]
+#   ./kiwisdr_benchmarks.py snr [receivers]
+#   ./kiwisdr_benchmarks.py history [receivers [days]]
+#   ./kiwisdr_benchmarks.py reliability [receivers [refreshes]]
+#   ./kiwisdr_benchmarks.py regions [stations [receivers]]
+#   ./kiwisdr_benchmarks.py bookmarks [stations ...]
+#   ./kiwisdr_benchmarks.py candidates [stations [receivers]]
+#   ./kiwisdr_benchmarks.py bands [stations]
+
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+default_snapshot = "/usr/local/src/kiwidata/kiwisdr_stripped.snap"
+rounds = 7
+
+# child program prefix: report elapsed ms and peak rss (kB) of the body
+_probe = """
+import resource, sys, time
+sys.path.insert(0, {here!r})
+rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+t0 = time.perf_counter()
+{body}
+t1 = time.perf_counter()
+rss1 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print((t1 - t0) * 1000, rss1 - rss0)
+"""
+
+
+def run_probe(body, cwd=here):
+    code = _probe.format(here=here, body=body)
+    samples = []
+    for _ in range(rounds):
+        out = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=cwd,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.split()
+        samples.append((float(out[0]), int(out[1])))
+    ms = statistics.median(s[0] for s in samples)
+    rss = statistics.median(s[1] for s in samples)
+    return ms, rss
+
+
+def report(title, results):
+    print(title)
+    for name, (ms, rss) in results.items():
+        print(f"  {name:<32} {ms:9.2f} ms  {rss / 1024:8.1f} MB rss")
+
+
+def bench_snapshot(snapshot=default_snapshot):
+    results = {}
+    if os.path.exists(os.path.join(here, "kiwisdr_stripped.py")):
+        # the first run leaves a .pyc behind, as the sorters did
+        results["import kiwisdr_stripped"] = run_probe(
+            "from kiwisdr_stripped import dictlist\n"
+            "n = sum(1 for site in dictlist if site['snr'])"
+        )
+    results["load_snapshot + 4 columns"] = run_probe(
+        "from kiwisdr_snapshot import load_snapshot\n"
+        f"snap = load_snapshot({snapshot!r})\n"
+        "cols = [snap.column(c) for c in ('lat', 'lon', 'snr_all', 'users')]\n"
+        "n = sum(1 for v in cols[2] if v)\n"
+        "urls = snap.strings('url')"
+    )
+    results["load_snapshot + records()"] = run_probe(
+        "from kiwisdr_snapshot import load_snapshot\n"
+        f"snap = load_snapshot({snapshot!r})\n"
+        "dictlist = list(snap.records())"
+    )
+    report(f"snapshot load ({rounds} rounds, median)", results)
+
+
+# a receiver record shaped like the ones in kiwisdr_com.js.  About a third
+# sit behind a proxy, and some sites run several channels on one host.
+def synthetic_site(rng, number):
+    snr = rng.randint(0, 40)
+    lat, lon = rng.uniform(-60, 70), rng.uniform(-180, 180)
+    # Maidenhead square of the position, e.g. IO81
+    grid = (
+        chr(65 + int((lon + 180) // 20))
+        + chr(65 + int((lat + 90) // 10))
+        + str(int((lon + 180) % 20 // 2))
+        + str(int((lat + 90) % 10))
+    )
+    if number % 3 == 0:
+        url = f"http://rx{number}.proxy.kiwisdr.com"
+    elif number % 10 == 1:
+        url = f"http://site{number // 100}.example.net:{8073 + number % 100 // 10}"
+    else:
+        url = f"http://rx{number}.example.net:8073"
+    return {
+        "updated": "Wednesday, 25-Mar-2026 04:21:19 GMT",
+        "id": f"{number:012x}",
+        "status": "active",
+        "offline": rng.choice(("no", "no", "no", "yes")),
+        "name": f"Synthetic receiver {number}, 0-30 MHz, wideband loop",
+        "sdr_hw": "KiwiSDR 2 v1.832 \u2063 \U0001f4e1 GPS \u2063 \U0001f4fb DRM",
+        "bands": rng.choice(("0-30000000", "10000-30000000", "0-32000000")),
+        "freq_offset": rng.choice(("0.000", "0.000", "100000.000")),
+        "users": str(rng.randint(0, 4)),
+        "users_max": "4",
+        "preempt": "0",
+        "gps": f"({lat:.6f}, {lon:.6f})",
+        "grid": grid,
+        "gps_good": str(rng.randint(0, 12)),
+        "fixes": "77363",
+        "fixes_min": "29",
+        "fixes_hour": str(rng.randint(0, 2000)),
+        "tdoa_id": "",
+        "tdoa_ch": "0",
+        "asl": "108",
+        "loc": "Somewhere, Earth",
+        "sw_version": "KiwiSDR_v1.832",
+        "antenna": "Wideband active loop on a 10 m mast.",
+        "snr": f"{snr},{max(snr - rng.randint(0, 3), 0)}",
+        "ant_connected": "1",
+        "adc_ov": str(rng.randint(0, 100000)),
+        "uptime": str(rng.randint(0, 2000000)),
+        "date": "Wed Mar 25 04:21:20 2026",
+        "url": url,
+    }
+
+
+# write a kiwisdr_com.js style list with `count` receivers
+def write_synthetic_list(path, count, seed=1):
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("// synthetic receiver list\nvar kiwisdr_com =\n[\n")
+        for number in range(count):
+            site = synthetic_site(rng, number)
+            file.write("\t{\n")
+            file.writelines(
+                f"\t\t{json.dumps(k)}:{json.dumps(v, ensure_ascii=False)},\n"
+                for k, v in site.items()
+            )
+            file.write("\t},\n")
+        file.write("]\n;\n")
+
+
+def bench_parse(receivers=100000):
+    from kiwisdr_parser import iter_objects, iter_records
+
+    receivers = int(receivers)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "kiwisdr_com.js")
+        write_synthetic_list(path, receivers)
+        size = os.path.getsize(path) / 1e6
+        print(f"parse {receivers} receivers ({size:.1f} MB, best of 3)")
+        for func in (iter_objects, iter_records):
+            best = min(_timed(lambda: sum(1 for _ in func(path))) for _ in range(3))
+            print(f"  {func.__name__:<16} {best * 1000:9.1f} ms")
+
+
+def _timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def _run_timed(command, env=None):
+    start = time.perf_counter()
+    subprocess.run(command, env=env, capture_output=True)
+    return (time.perf_counter() - start) * 1000
+
+
+# wrapper-to-menu latency with fresh data: the menu program is replaced by a
+# stub that exits at once, so the wall time is what the user waits before
+# the menu appears
+def bench_startup(wrapper="supersdr-wrapper"):
+    stripper = shutil.which("stripper")
+    if stripper is None:
+        print("stripper is not on PATH")
+        return
+    # bring the data up to date so the runs below take the fast path
+    subprocess.run([stripper, "--offline"], capture_output=True)
+    results = {}
+    results["stripper (fast path)"] = [_run_timed([stripper]) for _ in range(rounds)]
+    results["stripper --offline --force"] = [
+        _run_timed([stripper, "--offline", "--force"]) for _ in range(3)
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        for menu in ("fzf", "rofi"):
+            stub = os.path.join(tmp, menu)
+            with open(stub, "w") as file:
+                file.write("#!/bin/sh\ncat > /dev/null\n")
+            os.chmod(stub, 0o755)
+        env = dict(os.environ, PATH=f"{tmp}:{os.environ['PATH']}")
+        for mode in ("--servers", "--bookmarks"):
+            results[f"{os.path.basename(wrapper)} {mode}"] = [
+                _run_timed([wrapper, mode], env) for _ in range(rounds)
+            ]
+    print("startup latency with fresh data (median)")
+    for name, samples in results.items():
+        print(f"  {name:<36} {statistics.median(samples):9.1f} ms")
+
+
+# a snapshot (in memory) of `count` synthetic receivers
+def synthetic_snapshot(count, seed=1):
+    from kiwisdr_parser import typed_fields
+    from kiwisdr_snapshot import Snapshot, encode_snapshot
+
+    rng = random.Random(seed)
+    return Snapshot(
+        encode_snapshot(typed_fields(synthetic_site(rng, n)) for n in range(count))
+    )
+
+
+# queries shaped like the sorters': the SuperSDR list and a few bookmark
+# regions and bands
+select_queries = [
+    ((100000, 29999999), 19, None, None, "snr_all", 150),
+    ((5900000, 6200000), 15, (24, 50), (-125, -66), "snr_hf", 5),
+    ((9400000, 9900000), 20, (35, 72), (-25, 45), "snr_all", 5),
+    ((118000000, 137000000), 10, (-50, 0), (110, 180), "snr_all", 5),
+    ((7000000, 7300000), 12, (-45, 0), (-80, -30), 0.5, 5),
+]
+
+
+# vectorized selection against the record-by-record reference: the two must
+# return the same rows in the same order
+def bench_select(*receivers):
+    from kiwisdr_catalog import select, select_reference
+
+    mismatches = 0
+    print(f"select, {len(select_queries)} queries (best of 3)")
+    for count in [int(n) for n in receivers] or [1000, 10000, 100000]:
+        snapshot = synthetic_snapshot(count)
+        records = list(snapshot.records())
+        for query in select_queries:
+            if list(select(snapshot, *query)) != select_reference(records, *query):
+                print(f"  {count} receivers: results differ for {query}")
+                mismatches += 1
+        timings = {
+            "reference": lambda: [
+                select_reference(records, *q) for q in select_queries
+            ],
+            "vectorized": lambda: [select(snapshot, *q) for q in select_queries],
+        }
+        for name, func in timings.items():
+            best = min(_timed(func) for _ in range(3))
+            print(f"  {count:>7} receivers  {name:<12} {best * 1000:9.2f} ms")
+    if mismatches:
+        sys.exit(1)
+    print("  results identical")
+
+
+# composite score of a whole synthetic fleet: the feature columns once, then
+# the weighted sum on every call
+def bench_score(receivers=100000):
+    import numpy as np
+    from kiwisdr_catalog import snr_values
+    from kiwisdr_score import feature_matrix, load_weights, score
+
+    snapshot = synthetic_snapshot(int(receivers))
+    weights = load_weights(os.path.join(here, "weights"))
+    print(f"score {receivers} receivers (best of 3)")
+    first = _timed(lambda: feature_matrix(snapshot))
+    best = min(_timed(lambda: score(snapshot, weights)) for _ in range(3))
+    print(f"  {'feature columns (once)':<24} {first * 1000:9.2f} ms")
+    print(f"  {'score (cached features)':<24} {best * 1000:9.2f} ms")
+    # a score by another SNR figure swaps only the SNR term
+    weight = weights.get("snr", 0.0)
+    for figure in ("snr_hf", 0.25):
+        expected = score(snapshot, weights) + weight * (
+            snr_values(snapshot, figure) - snapshot.array("snr_all")
+        )
+        if not np.allclose(score(snapshot, weights, figure), expected):
+            print(f"  score by {figure}: results differ")
+            sys.exit(1)
+    print("  scores by band figure identical")
+
+
+filter_expressions = [
+    "covers=100-30000 snr>19 free_slots>0",
+    'snr>=20 free_slots>0 hw~"KiwiSDR 2" band=Shortwave within(region=Tokyo)',
+    "freq=7100 snr_hf>15 within(35, 72, -25, 45) uptime>86400 offline=0",
+]
+
+
+# filter expressions over a synthetic fleet: compiling (once per text), the
+# first evaluation on a snapshot and a cached one
+def bench_filter(receivers=100000):
+    import kiwisdr_filter
+
+    kiwisdr_filter.band_file = os.path.join(here, "bands")
+    kiwisdr_filter.region_file = os.path.join(here, "regions")
+    snapshot = synthetic_snapshot(int(receivers))
+    # build the string table and its index outside the timings; they are
+    # made once per snapshot and shared by every query
+    snapshot.equals("status", "active")
+    print(f"filter {receivers} receivers")
+    for text in filter_expressions:
+        compiled = _timed(lambda: kiwisdr_filter.compile_filter(text))
+        first = _timed(lambda: kiwisdr_filter.query(snapshot, text))
+        again = _timed(lambda: kiwisdr_filter.query(snapshot, text))
+        print(f"  {text}")
+        print(
+            f"    compile {compiled * 1000:7.2f} ms  first {first * 1000:7.2f} ms"
+            f"  cached {again * 1000:7.2f} ms"
+        )
+
+
+# threshold relaxation for bookmark-sized lists: lowering the SNR limit a
+# step at a time and filtering the snapshot again at each step, against one
+# sorted SNR index per band and a binary search per step.  Both must settle
+# on the same threshold and rows.
+def bench_relax(receivers=100000, target=3, step=3, floor=0):
+    from kiwisdr_catalog import (
+        SnrIndex,
+        count_above,
+        relaxed_threshold,
+        select,
+        select_mask,
+    )
+
+    snapshot = synthetic_snapshot(int(receivers))
+    target, step, floor = int(target), int(step), int(floor)
+    # bookmark queries with a strict limit, over every region box of the
+    # regions file
+    boxes = []
+    with open(os.path.join(here, "regions")) as file:
+        for line in file:
+            fields = line.split(",")
+            if len(fields) >= 5 and not line.startswith("#"):
+                lat = (float(fields[1]), float(fields[2]))
+                boxes.append((lat, (float(fields[3]), float(fields[4]))))
+    queries = [
+        (query[0], query[1] + 20, box) for query in select_queries for box in boxes
+    ]
+
+    def refilter():
+        results = []
+        for freq_range, min_snr, (lat, lon) in queries:
+            threshold = min_snr
+            rows = select(snapshot, freq_range, threshold, lat, lon)
+            while len(rows) < target and threshold > floor:
+                threshold = max(threshold - step, floor)
+                rows = select(snapshot, freq_range, threshold, lat, lon)
+            results.append((threshold, list(rows)))
+        return results
+
+    def indexed():
+        indexes = {}
+        results = []
+        for freq_range, min_snr, (lat, lon) in queries:
+            if freq_range not in indexes:
+                mask = select_mask(snapshot, freq_range, -float("inf"))
+                indexes[freq_range] = SnrIndex(snapshot, mask)
+            rows, snr = indexes[freq_range].region(lat, lon)
+            threshold = relaxed_threshold(snr, min_snr, target, step, floor)
+            results.append((threshold, list(rows[: count_above(snr, threshold)])))
+        return results
+
+    print(f"relax {receivers} receivers, {len(queries)} queries (best of 3)")
+    if refilter() != indexed():
+        print("  results differ")
+        sys.exit(1)
+    for name, func in {"refilter": refilter, "indexed": indexed}.items():
+        best = min(_timed(func) for _ in range(3))
+        print(f"  {name:<12} {best * 1000:9.2f} ms")
+    print("  results identical")
+
+
+# region boxes of the bookmarks from a GridIndex against a scan of every
+# receiver of the band, and the whole bookmark build for `stations`
+# stations spread over the regions, against filtering the receiver list
+# again for every station and box as the script used to (timed on a sample
+# of stations and scaled up)
+def bench_regions(stations=10000, receivers=100000):
+    import numpy as np
+    from kiwisdr_catalog import (
+        GridIndex,
+        SnrIndex,
+        count_above,
+        load_bands,
+        select,
+        select_mask,
+    )
+    from kiwisdr_stages import load_stage
+
+    snapshot = synthetic_snapshot(int(receivers))
+    stations = int(stations)
+    lat, lon = snapshot.array("lat"), snapshot.array("lon")
+    regions = []
+    with open(os.path.join(here, "regions")) as file:
+        for line in file:
+            fields = line.split(",")
+            if len(fields) >= 5 and not line.startswith("#"):
+                box = (
+                    (float(fields[1]), float(fields[2])),
+                    (float(fields[3]), float(fields[4])),
+                )
+                regions.append((fields[0], box))
+    bands = load_bands(os.path.join(here, "bands"))
+    indexes = [
+        SnrIndex(snapshot, select_mask(snapshot, (low, high), -np.inf))
+        for _, _, low, high, _ in bands
+    ]
+
+    def scan():
+        found = []
+        for index in indexes:
+            rows_lat, rows_lon = lat[index.rows], lon[index.rows]
+            for _, ((south, north), (west, east)) in regions:
+                inside = (rows_lat > south) & (rows_lat < north)
+                inside &= (rows_lon > west) & (rows_lon < east)
+                found.append(index.rows[inside])
+        return found
+
+    def grid():
+        cells = GridIndex(lat, lon)
+        found = []
+        for index in indexes:
+            if not len(index):
+                found += [index.rows] * len(regions)
+                continue
+            position = np.full(len(snapshot), -1, dtype=np.intp)
+            position[index.rows] = np.arange(len(index.rows))
+            for _, (lat_range, lon_range) in regions:
+                inside = position[cells.inside(lat_range, lon_range)]
+                found.append(index.rows[np.sort(inside[inside >= 0])])
+        return found
+
+    print(
+        f"regions: {len(regions)} boxes x {len(bands)} bands, {len(snapshot)} receivers"
+    )
+    if any(not np.array_equal(a, b) for a, b in zip(scan(), grid())):
+        print("  results differ")
+        sys.exit(1)
+    for name, func in {"scan": scan, "grid": grid}.items():
+        best = min(_timed(func) for _ in range(3))
+        print(f"  {name:<24} {best * 1000:9.2f} ms")
+
+    # stations spread over the regions and bands: (band range, boxes)
+    rng = random.Random(1)
+    boxes = {}
+    for name, box in regions:
+        boxes.setdefault(name, []).append(box)
+    names = sorted(boxes)
+    queries = []
+    for _ in range(stations):
+        _, _, low, high, _ = rng.choice(bands)
+        name = rng.choice(names)
+        queries.append(((low, high), name, boxes[name]))
+    sample = 200
+
+    def refilter(queries):
+        for freq_range, _, region in queries:
+            for lat_range, lon_range in region:
+                select(snapshot, freq_range, 5, lat_range, lon_range, limit=5)
+
+    def indexed(queries):
+        indexes = {}
+        for freq_range, _, region in queries:
+            if freq_range not in indexes:
+                mask = select_mask(snapshot, freq_range, -np.inf)
+                indexes[freq_range] = SnrIndex(snapshot, mask)
+            for lat_range, lon_range in region:
+                rows, snr = indexes[freq_range].region(lat_range, lon_range)
+                rows[: count_above(snr, 5)][:5]
+
+    print(f"bookmarks: {stations} stations")
+    scaled = _timed(lambda: refilter(queries[:sample])) * stations / sample
+    print(f"  {'refilter (scaled)':<24} {scaled * 1000:9.2f} ms")
+    print(f"  {'indexed':<24} {_timed(lambda: indexed(queries)) * 1000:9.2f} ms")
+    bookmarks = load_stage(os.path.join(here, "sdr-stream-bookmarks.py"))
+    with tempfile.NamedTemporaryFile("w", suffix=".csv") as file:
+        for n, ((low, high), name, _) in enumerate(queries):
+            file.write(f"Station {n},{name},url,{(low + high) // 2000},am,kiwi\n")
+        file.flush()
+        bookmarks.station_file = file.name
+        built = _timed(
+            lambda: [list(lines) for lines in bookmarks.build(snapshot).values()]
+        )
+    print(f"  {'whole build':<24} {built * 1000:9.2f} ms")
+
+
+# the bookmark build for growing station lists, streamed to the output
+# files as the lines are made against joined into one text first; time and
+# peak memory in a fresh interpreter each
+def bench_bookmarks(*stations):
+    from kiwisdr_snapshot import write_snapshot
+
+    stations = [int(count) for count in stations] or [1000, 10000]
+    rng = random.Random(1)
+    with open(os.path.join(here, "stations")) as file:
+        lines = [line for line in file if line.strip()]
+    with tempfile.TemporaryDirectory() as directory:
+        from kiwisdr_parser import typed_fields
+
+        snapshot = os.path.join(directory, "receivers.snap")
+        sites = (typed_fields(synthetic_site(rng, n)) for n in range(1000))
+        write_snapshot(sites, snapshot)
+        setup = (
+            "from kiwisdr_snapshot import load_snapshot\n"
+            "from kiwisdr_stages import load_stage\n"
+            "from kiwisdr_io import atomic_write\n"
+            "bookmarks = load_stage('sdr-stream-bookmarks.py')\n"
+            "bookmarks.station_file = {stations!r}\n"
+            "bookmarks.target_file = {directory!r} + '/bookmarks'\n"
+            "bookmarks.relax_file = {directory!r} + '/relaxed'\n"
+            f"outputs = bookmarks.build(load_snapshot({snapshot!r}))\n"
+        )
+        variants = {
+            "streamed": "for path, data in outputs.items():\n"
+            "    atomic_write(path, data)\n",
+            "joined": "for path, data in outputs.items():\n"
+            "    atomic_write(path, ''.join(data))\n",
+        }
+        for count in stations:
+            path = os.path.join(directory, f"stations.{count}")
+            with open(path, "w") as file:
+                file.writelines(lines[n % len(lines)] for n in range(count))
+            results = {}
+            for name, body in variants.items():
+                code = setup.format(stations=path, directory=directory) + body
+                results[f"{count} stations, {name}"] = run_probe(code)
+            size = os.path.getsize(os.path.join(directory, "bookmarks"))
+            report(f"bookmarks, {size / 1024:.0f} kB written", results)
+
+
+# the bookmark build with every candidate list worked out again for each
+# station, with lists shared within the run, and with the lists kept from a
+# previous run of the same snapshot; the bookmarks must be the same
+def bench_candidates(stations=10000, receivers=100000):
+    from kiwisdr_parser import typed_fields
+    from kiwisdr_snapshot import Snapshot, encode_snapshot
+    from kiwisdr_stages import load_stage
+
+    rng = random.Random(1)
+    sites = (typed_fields(synthetic_site(rng, n)) for n in range(int(receivers)))
+    snapshot = Snapshot(encode_snapshot(sites, generation=1))
+    with open(os.path.join(here, "stations")) as file:
+        lines = [line for line in file if line.strip()]
+    bookmarks = load_stage(os.path.join(here, "sdr-stream-bookmarks.py"))
+
+    def run():
+        random.seed(1)
+        outputs = bookmarks.build(snapshot)
+        return ["".join(lines) for lines in outputs.values()]
+
+    class Uncached(bookmarks.CandidateCache):
+        def lookup(self, query, detail, compute):
+            self.misses += 1
+            rows, used, _ = compute()
+            return rows, used
+
+    with tempfile.TemporaryDirectory() as directory:
+        bookmarks.station_file = os.path.join(directory, "stations")
+        with open(bookmarks.station_file, "w") as file:
+            file.writelines(lines[n % len(lines)] for n in range(int(stations)))
+        bookmarks.cache_file = os.path.join(directory, "candidates")
+        print(f"candidates: {stations} stations, {receivers} receivers")
+        results = []
+        for name in ("uncached", "one run", "kept"):
+            if name == "uncached":
+                bookmarks.CandidateCache, cached = Uncached, bookmarks.CandidateCache
+            start = time.perf_counter()
+            outputs = run()
+            seconds = time.perf_counter() - start
+            if name == "uncached":
+                bookmarks.CandidateCache = cached
+            else:
+                with open(bookmarks.cache_file, "w") as file:
+                    file.write(outputs[2])
+            counts = outputs[1].splitlines()[-1].lstrip("# ")
+            print(f"  {name:<12} {seconds * 1000:9.2f} ms  {counts}")
+            results.append(outputs[0])
+    if len(set(results)) != 1:
+        print("  results differ")
+        sys.exit(1)
+    print("  results identical")
+
+
+# the band of every station frequency: a scan of the bands table row by row
+# for each station, as the bookmarks used to, against a binary search per
+# station and one searchsorted() over the whole column.  Frequencies are
+# spread over 0-150 MHz, so some fall outside every band.
+def bench_bands(stations=100000):
+    import numpy as np
+    import pandas as pd
+    from kiwisdr_catalog import BandTable, load_bands
+
+    path = os.path.join(here, "bands")
+    bands = load_bands(path)
+    table = BandTable(bands)
+    columns = ["band", "snr_limit", "freq_bot", "freq_top", "hf_weight"]
+    frame = pd.read_csv(path, names=columns, header=None).set_index("band")
+    hz = np.random.default_rng(1).integers(0, 150000, int(stations)) * 1000
+
+    def iterrows(count=None):
+        found = []
+        for frequency in hz[:count].tolist():
+            band = None
+            for name, row in frame.iterrows():
+                if row["freq_bot"] <= frequency <= row["freq_top"]:
+                    band = name
+            found.append(band)
+        return found
+
+    def bisected():
+        return [(table.band(frequency) or [None])[0] for frequency in hz.tolist()]
+
+    def vectorized():
+        names = [band[0] for band in bands] + [None]
+        return [names[number] for number in table.numbers(hz).tolist()]
+
+    print(f"bands: {len(hz)} station frequencies, {len(bands)} bands")
+    if not iterrows(1000) == bisected()[:1000] == vectorized()[:1000]:
+        print("  results differ")
+        sys.exit(1)
+    if bisected() != vectorized():
+        print("  results differ")
+        sys.exit(1)
+    sample = min(1000, len(hz))
+    print(
+        f"  {'iterrows (scaled)':<20} {_timed(lambda: iterrows(sample)) * len(hz) / sample * 1000:9.2f} ms"
+    )
+    for name, func in {"bisect": bisected, "vectorized": vectorized}.items():
+        best = min(_timed(func) for _ in range(3))
+        print(f"  {name:<20} {best * 1000:9.2f} ms")
+    print("  results identical")
+
+
+# "who can tune this" from the coverage index against a scan of the
+# coverage columns: every station frequency, every band as a range the
+# receiver must cover and as one it must reach some part of
+def bench_coverage(receivers=100000):
+    import numpy as np
+    from kiwisdr_catalog import CoverageIndex, coverage, load_bands
+
+    snapshot = synthetic_snapshot(int(receivers))
+    tune_lo, tune_hi = coverage(snapshot)
+    bands = [(band[2], band[3]) for band in load_bands(os.path.join(here, "bands"))]
+    with open(os.path.join(here, "stations")) as file:
+        freqs = sorted(
+            {int(line.split(",")[3]) * 1000 for line in file if line.strip()}
+        )
+    freqs += [0, 5000000, 30000000, 30000001, 130000000, 10**12]
+
+    def scanned():
+        return (
+            [(tune_lo <= hz) & (tune_hi >= hz) for hz in freqs],
+            [(tune_lo <= lo) & (tune_hi >= hi) for lo, hi in bands],
+            [(tune_lo <= hi) & (tune_hi >= lo) for lo, hi in bands],
+        )
+
+    def indexed(index):
+        return (
+            [index.point(hz) for hz in freqs],
+            [index.covering(lo, hi) for lo, hi in bands],
+            [index.overlapping(lo, hi) for lo, hi in bands],
+        )
+
+    print(f"coverage {receivers} receivers, {len(freqs)} frequencies")
+    built = _timed(lambda: CoverageIndex(snapshot))
+    index = CoverageIndex(snapshot)
+    expected = scanned()
+    found = indexed(index)
+    same = all(
+        np.array_equal(a, b)
+        for kind, other in zip(expected, found)
+        for a, b in zip(kind, other)
+    )
+    same = same and all(
+        np.array_equal(index.rows(hz), np.flatnonzero(mask))
+        for hz, mask in zip(freqs, expected[0])
+    )
+    if not same:
+        print("  results differ")
+        sys.exit(1)
+    # a fresh index fills its mask cache on the first round of queries
+    fresh = CoverageIndex(snapshot)
+    first = _timed(lambda: indexed(fresh))
+    print(f"  {'index (once)':<16} {built * 1000:9.2f} ms")
+    print(f"  {'scan':<16} {min(_timed(scanned) for _ in range(3)) * 1000:9.2f} ms")
+    print(f"  {'index, first':<16} {first * 1000:9.2f} ms")
+    again = min(_timed(lambda: indexed(index)) for _ in range(3))
+    print(f"  {'index, cached':<16} {again * 1000:9.2f} ms")
+    hz = 7100000
+    best = min(_timed(lambda: index.rows(hz)) for _ in range(3))
+    print(f"  {'rows(7.1 MHz)':<16} {best * 1000:9.2f} ms")
+    print("  results identical")
+
+
+# "snr" fields as listed and the (all-band, HF) figures they must give
+snr_fixtures = {
+    "46,46": (46, 46),
+    "9,9": (9, 9),
+    "12,3": (12, 3),
+    "9": (9, 9),
+    " 8, 9": (8, 9),
+    "25,": (25, 25),
+    "": (0, 0),
+}
+
+
+# both SNR figures are parsed as numbers, and every band is judged by its
+# own figure: band lists against a record by record reference on a fleet
+# whose HF figures differ from the all-band ones
+def bench_snr(receivers=10000):
+    from kiwisdr_catalog import band_masks, band_snr, load_bands
+    from kiwisdr_parser import typed_fields
+
+    failures = 0
+    for text, expected in snr_fixtures.items():
+        fields = typed_fields({"snr": text})
+        if (fields["snr_all"], fields["snr_hf"]) != expected:
+            print(f"  snr {text!r} read as {fields['snr_all']},{fields['snr_hf']}")
+            failures += 1
+
+    snapshot = synthetic_snapshot(int(receivers))
+    records = list(snapshot.records())
+    bands = load_bands(os.path.join(here, "bands"))
+    bands += [("blend", 12, 3000001, 29999999, 0.25)]
+    masks = band_masks(snapshot, bands)
+    for band, figure, mask in zip(bands, band_snr(bands), masks):
+        expected = []
+        for row, site in enumerate(records):
+            offset = round(site["freq_offset"] * 1000)
+            value = site["snr_all"] + figure * (site["snr_hf"] - site["snr_all"])
+            if (
+                not site["offline"]
+                and site["status"] == "active"
+                and site["users"] < site["users_max"]
+                and site["band_lo"] + offset < band[2]
+                and site["band_hi"] + offset > band[3]
+                and value > band[1]
+            ):
+                expected.append(row)
+        if list(mask.nonzero()[0]) != expected:
+            print(f"  band {band[0]}: receivers differ")
+            failures += 1
+    print(f"snr: {len(snr_fixtures)} fields, {len(bands)} bands, {receivers} receivers")
+    if failures:
+        sys.exit(1)
+    print("  results identical")
+
+
+# a synthetic snapshot as it might look at refresh `step`: SNR, users and
+# uptime move, a few receivers are offline (or those of `offline`, a mask)
+class _Refresh:
+    def __init__(self, snapshot, step, rng, offline=None):
+        import numpy as np
+
+        self._snapshot = snapshot
+        self.generation = step + 1
+        count = len(snapshot)
+        self._columns = {
+            "snr_all": snapshot.array("snr_all") + rng.integers(-3, 4, count),
+            "users": rng.integers(0, 5, count),
+            "uptime": snapshot.array("uptime") + step * 7200,
+            "offline": (rng.random(count) < 0.05).astype(np.int8),
+        }
+        if offline is not None:
+            self._columns["offline"] = offline.astype(np.int8)
+
+    def __len__(self):
+        return len(self._snapshot)
+
+    def array(self, name):
+        if name in self._columns:
+            return self._columns[name]
+        return self._snapshot.array(name)
+
+    def strings(self, name):
+        return self._snapshot.strings(name)
+
+    def equals(self, name, value):
+        return self._snapshot.equals(name, value)
+
+
+# a year of two-hourly refreshes into the history store: time per append
+# (with and without a rollup), size on disk, and query times
+def bench_history(receivers=1000, days=365):
+    import numpy as np
+    from kiwisdr_history import History
+
+    snapshot = synthetic_snapshot(int(receivers))
+    rng = np.random.default_rng(1)
+    start = 1735689600  # 2025-01-01 UTC
+    steps = int(float(days) * 12)
+    appends = []
+    with tempfile.TemporaryDirectory() as directory:
+        history = History(directory)
+        for step in range(steps):
+            refresh = _Refresh(snapshot, step, rng)
+            now = start + step * 7200
+            appends.append(_timed(lambda: history.append(refresh, now)))
+        appends.sort()
+        print(f"history: {steps} refreshes of {receivers} receivers")
+        print(f"  {'append, median':<24} {appends[len(appends) // 2] * 1000:9.2f} ms")
+        print(f"  {'append, slowest':<24} {appends[-1] * 1000:9.2f} ms")
+        for name, size in history.sizes().items():
+            print(f"  {name + ' on disk':<24} {size / 1024:9.1f} kB")
+        url = snapshot.strings("url")[0]
+        end = start + steps * 7200
+        queries = {
+            "one receiver, all": lambda: history.query(url=url),
+            "one receiver, 7 days": lambda: history.query(end - 7 * 86400, url=url),
+            "fleet, 1 day": lambda: history.query(end - 86400),
+            "fleet, all": lambda: history.query(),
+        }
+        for name, func in queries.items():
+            best = min(_timed(func) for _ in range(3))
+            print(f"  {name:<24} {best * 1000:9.2f} ms  {len(func()):>8} records")
+
+
+# two-hourly refreshes into the reliability state: every tenth receiver is
+# down every other refresh, the others 1% of the time.  Time per update,
+# receivers touched, and the scores against a moving average updated for
+# every receiver at every refresh
+def bench_reliability(receivers=100000, refreshes=84):
+    import numpy as np
+    from kiwisdr_catalog import usable_mask
+    from kiwisdr_reliability import _rate, load_state, prior, reliability, update
+
+    snapshot = synthetic_snapshot(int(receivers))
+    count, refreshes = len(snapshot), int(refreshes)
+    rng = np.random.default_rng(1)
+    flapping = np.arange(count) % 10 == 0
+    listed_up = usable_mask(snapshot)
+    listed_offline = snapshot.array("offline") != 0
+    start = 1735689600  # 2025-01-01 UTC
+    state = load_state(os.devnull)
+    expected = np.full(count, prior)
+    up = None
+    updates, touched = [], []
+    for step in range(refreshes):
+        offline = (flapping & (step % 2 == 1)) | (rng.random(count) < 0.01)
+        offline |= listed_offline
+        refresh = _Refresh(snapshot, step, rng, offline)
+        now = start + step * 7200
+        if up is not None:
+            expected = up + (expected - up) * np.exp(-_rate() * 7200)
+        up = (listed_up & ~offline).astype(np.float64)
+        updates.append(_timed(lambda: touched.append(update(state, refresh, now))))
+    now = start + refreshes * 7200
+    expected = up + (expected - up) * np.exp(-_rate() * 7200)
+    with tempfile.NamedTemporaryFile("w", suffix=".json") as file:
+        json.dump(state, file)
+        file.flush()
+        read = _timed(lambda: reliability(snapshot, file.name, now))
+        scores = reliability(snapshot, file.name, now)
+    updates.sort()
+    print(f"reliability: {refreshes} refreshes of {count} receivers")
+    print(f"  {'update, median':<24} {updates[len(updates) // 2] * 1000:9.2f} ms")
+    print(f"  {'touched, median':<24} {sorted(touched)[len(touched) // 2]:>9}")
+    print(f"  {'scores of a snapshot':<24} {read * 1000:9.2f} ms")
+    steady = listed_up & ~flapping
+    for name, rows in (("steady", steady), ("flapping", listed_up & flapping)):
+        print(f"  {name + ', mean':<24} {scores[rows].mean():9.3f}")
+    error = np.abs(scores - expected).max()
+    if error > 1e-9:
+        print(f"  scores differ by up to {error:.3g}")
+        sys.exit(1)
+    print("  results identical")
+
+
+diversity_caps = {"host": 2, "front_end": 50, "square": 3, "field": 10}
+
+
+# diversity-capped ranking against a plain one, and checked against the
+# same caps applied record by record to the fully sorted list
+def bench_diverse(receivers=100000, limit=150):
+    from kiwisdr_catalog import diversity_groups, rank, usable_mask
+    from kiwisdr_sources import front_end, site_key
+
+    import numpy as np
+
+    snapshot = synthetic_snapshot(int(receivers))
+    limit = int(limit)
+    mask = usable_mask(snapshot)
+    caps = diversity_caps
+
+    def reference():
+        records = list(snapshot.records())
+        order = sorted(np.flatnonzero(mask), key=lambda r: -records[r]["snr_all"])
+        counts = {}
+        kept = []
+        for row in order:
+            grid = records[row]["grid"][:4].upper()
+            keys = {
+                "host": site_key(records[row]["url"]),
+                "front_end": front_end(records[row]["url"]),
+                "square": grid,
+                "field": grid[:2],
+            }
+            if any(
+                keys[name] and counts.get((name, keys[name]), 0) >= cap
+                for name, cap in caps.items()
+            ):
+                continue
+            for name in caps:
+                if keys[name]:
+                    counts[(name, keys[name])] = counts.get((name, keys[name]), 0) + 1
+            kept.append(row)
+            if len(kept) == limit:
+                break
+        return kept
+
+    print(f"diverse {receivers} receivers, top {limit} (best of 3)")
+    groups = _timed(lambda: diversity_groups(snapshot))
+    if list(rank(snapshot, mask, limit=limit, caps=caps)) != reference():
+        print("  results differ")
+        sys.exit(1)
+    timings = {
+        "plain": lambda: rank(snapshot, mask, limit=limit),
+        "capped": lambda: rank(snapshot, mask, limit=limit, caps=caps),
+    }
+    print(f"  {'groups (once)':<12} {groups * 1000:9.2f} ms")
+    for name, func in timings.items():
+        best = min(_timed(func) for _ in range(3))
+        print(f"  {name:<12} {best * 1000:9.2f} ms")
+    print("  results identical")
+
+
+benchmarks = {
+    "snapshot": bench_snapshot,
+    "parse": bench_parse,
+    "startup": bench_startup,
+    "select": bench_select,
+    "score": bench_score,
+    "filter": bench_filter,
+    "relax": bench_relax,
+    "diverse": bench_diverse,
+    "coverage": bench_coverage,
+    "snr": bench_snr,
+    "history": bench_history,
+    "reliability": bench_reliability,
+    "regions": bench_regions,
+    "bookmarks": bench_bookmarks,
+    "candidates": bench_candidates,
+    "bands": bench_bands,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in benchmarks:
+        print(f"usage: {sys.argv[0]} {{{','.join(benchmarks)}}} [args]")
+        sys.exit(2)
+    benchmarks[sys.argv[1]](*sys.argv[2:])
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+# Make-like build graph for the kiwidata outputs.
+#
+# Each artifact names its output file, the files it is built from and the
+# function that builds it.  The content hash of every input is recorded per
+# artifact after a successful build; an artifact is rebuilt only when its
+# output is missing or one of its inputs no longer matches the recorded
+# hash.  Artifacts whose inputs are other artifacts' outputs are built after
+# them, so an unchanged intermediate (e.g. a snapshot rebuilt from a list
+# with identical receiver data) stops the rebuild from spreading.
+#
+# Artifacts at the same depth of the graph are built concurrently on a
+# thread pool.  An action may write its output itself or return the data
+# for the build to write; returned data is written to temporary files by
+# the same worker and renamed into place only when every action at that
+# depth succeeded, so one failing sorter cannot leave its sibling's new
+# output next to its own stale one.  Artifacts depending on a
+# failed one are skipped and rebuilt on the next run.
+
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from kiwisdr_io import (
+    atomic_write,
+    discard,
+    file_signature,
+    publish,
+    signature_matches,
+    stage,
+)
+
+# name: label used in reports and the state file
+# output: path of the file the action writes
+# inputs: paths the action reads
+# action: callable doing the build; raises on failure.  Returns None when
+#         it wrote the output itself, the data to write (str, bytes or an
+#         iterable of str, written as it is produced), or {path: data} when
+#         it produces further files next to the output
+Artifact = namedtuple("Artifact", "name output inputs action")
+
+
+class BuildError(Exception):
+    pass
+
+
+def load_state(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+# artifacts ordered so every producer comes before its consumers
+def build_order(artifacts):
+    producers = {artifact.output: artifact for artifact in artifacts}
+    ordered = []
+    visiting = set()
+    done = set()
+
+    def visit(artifact):
+        if artifact.name in done:
+            return
+        if artifact.name in visiting:
+            raise BuildError(f"dependency cycle through {artifact.name}")
+        visiting.add(artifact.name)
+        for path in artifact.inputs:
+            if path in producers:
+                visit(producers[path])
+        visiting.discard(artifact.name)
+        done.add(artifact.name)
+        ordered.append(artifact)
+
+    for artifact in artifacts:
+        visit(artifact)
+    return ordered
+
+
+# why `artifact` must be rebuilt (empty when it is up to date)
+def stale_reasons(artifact, recorded):
+    if not os.path.exists(artifact.output):
+        return ["output missing"]
+    if recorded is None:
+        return ["never built"]
+    reasons = []
+    for path in artifact.inputs:
+        signature = recorded["inputs"].get(path)
+        if signature is None:
+            reasons.append(f"new input {os.path.basename(path)}")
+        elif not signature_matches(path, signature):
+            reasons.append(f"{os.path.basename(path)} changed")
+    return reasons
+
+
+# artifacts grouped by depth: each group only needs outputs of earlier ones
+def build_levels(artifacts):
+    producers = {artifact.output: artifact for artifact in artifacts}
+    depth = {}
+    for artifact in build_order(artifacts):
+        depth[artifact.name] = 1 + max(
+            [
+                depth[producers[path].name]
+                for path in artifact.inputs
+                if path in producers
+            ],
+            default=-1,
+        )
+    levels = [[] for _ in range(max(depth.values(), default=-1) + 1)]
+    for artifact in build_order(artifacts):
+        levels[depth[artifact.name]].append(artifact)
+    return levels
+
+
+# run the action and write what it returns to temporary files; returns
+# {output path: temporary path}
+def run_action(artifact, entry):
+    start = time.perf_counter()
+    staged = {}
+    try:
+        data = artifact.action()
+        if not isinstance(data, dict):
+            data = {} if data is None else {artifact.output: data}
+        for path, content in data.items():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            staged[path] = stage(path, content)
+    except Exception as exc:
+        entry["error"] = f"{type(exc).__name__}: {exc}"
+    finally:
+        entry["seconds"] = time.perf_counter() - start
+    return staged
+
+
+# bring every artifact up to date.  Returns a report entry per artifact:
+# {"name", "rebuilt", "reasons", "seconds", "error"}.
+def build(artifacts, state_path, force=False, workers=4):
+    state = load_state(state_path)
+    report = []
+    failed = set()
+    for level in build_levels(artifacts):
+        pending = []
+        for artifact in level:
+            recorded = state.get(artifact.name)
+            reasons = ["forced"] if force else stale_reasons(artifact, recorded)
+            entry = {"name": artifact.name, "rebuilt": False, "reasons": reasons}
+            report.append(entry)
+            broken = [path for path in artifact.inputs if path in failed]
+            if broken:
+                entry["error"] = "skipped: " + ", ".join(
+                    f"{os.path.basename(path)} failed" for path in broken
+                )
+                entry["seconds"] = 0.0
+                failed.add(artifact.output)
+            elif reasons:
+                pending.append((artifact, entry))
+        if not pending:
+            continue
+
+        # signatures of what the actions are about to read
+        signatures = {}
+        for artifact, entry in pending:
+            signatures[artifact.name] = {}
+            for path in artifact.inputs:
+                try:
+                    signatures[artifact.name][path] = file_signature(path)
+                except FileNotFoundError:
+                    pass
+        with ThreadPoolExecutor(max_workers=min(workers, len(pending))) as pool:
+            futures = [
+                pool.submit(run_action, artifact, entry) for artifact, entry in pending
+            ]
+            results = [future.result() for future in futures]
+
+        # all or nothing: keep the previous outputs of the whole level when
+        # any of its actions failed
+        errors = [entry["name"] for _, entry in pending if entry.get("error")]
+        for (artifact, entry), staged in zip(pending, results):
+            if errors and not entry.get("error"):
+                entry["error"] = "not published: " + ", ".join(errors) + " failed"
+            if entry.get("error"):
+                failed.add(artifact.output)
+                for temp_path in staged.values():
+                    discard(temp_path)
+                continue
+            for path, temp_path in staged.items():
+                publish(temp_path, path)
+            entry["rebuilt"] = True
+            state[artifact.name] = {
+                "inputs": signatures[artifact.name],
+                "built": time.time(),
+                "seconds": entry["seconds"],
+            }
+        atomic_write(state_path, json.dumps(state, indent=1))
+    return report
+
+
+def explain(report, file=sys.stdout):
+    for entry in report:
+        if entry.get("error"):
+            status = f"FAILED after {entry['seconds'] * 1000:.1f} ms"
+            detail = entry["error"]
+        elif entry["rebuilt"]:
+            status = f"rebuilt in {entry['seconds'] * 1000:.1f} ms"
+            detail = ", ".join(entry["reasons"])
+        else:
+            status = "up to date"
+            detail = "no input changed"
+        print(f"{entry['name']:<24} {status:<24} {detail}", file=file)
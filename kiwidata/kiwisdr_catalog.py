@@ -0,0 +1,575 @@
+#!/usr/bin/env python3
+
+# Receiver selection over the snapshot columns.
+#
+# Every predicate of a query is evaluated on whole numpy columns and the
+# results are combined into one boolean mask; the receivers passing it are
+# ranked by SNR, best first, with a partial sort that only orders the ones
+# kept.  Receivers with equal SNR keep snapshot order, as they did under the
+# stable sort of the original scripts.  SNR is the integer pair from the
+# list ("snr_all" over 0-30 MHz, "snr_hf" over HF), not the text, so "9,9"
+# no longer ranks above "46,46".
+#
+# select_reference() is the same query written record by record, the way the
+# sorters used to do it; kiwisdr_benchmarks.py checks that both agree.
+
+import bisect
+import csv
+import math
+import re
+
+import numpy as np
+from kiwisdr_select import TopK, capped_rows, top_rows
+from kiwisdr_sources import front_end, site_key
+
+# statuses of a receiver that can take a listener ("" for lists without one)
+usable_status = ("active", "")
+# size in degrees of the cells of the spatial index over receiver positions
+grid_cell = 2.0
+
+
+# the SNR of every receiver by one figure of the list: "snr_all" (0-30 MHz)
+# or "snr_hf" (HF only) by name, or a number w blending the two as
+# snr_all + w * (snr_hf - snr_all), so 0 is the all-band figure and 1 the
+# HF one.  Blends are computed once per snapshot.
+def snr_values(snapshot, snr="snr_all"):
+    snr = _snr_figure(snr)
+    if isinstance(snr, str):
+        return snapshot.array(snr)
+
+    def compute(snapshot):
+        all_band = snapshot.array("snr_all").astype(np.float64)
+        return all_band + snr * (snapshot.array("snr_hf") - all_band)
+
+    return snapshot.derived(f"snr {snr}", compute)
+
+
+def _snr_figure(snr):
+    if isinstance(snr, str):
+        return snr
+    snr = float(snr)
+    return {0.0: "snr_all", 1.0: "snr_hf"}.get(snr, snr)
+
+
+# snr_values() for one record
+def _site_snr(site, snr):
+    snr = _snr_figure(snr)
+    if isinstance(snr, str):
+        return site[snr]
+    return float(site["snr_all"]) + snr * (site["snr_hf"] - float(site["snr_all"]))
+
+
+# receivers that are up and listed as usable
+def usable_mask(snapshot):
+    mask = snapshot.array("offline") == 0
+    status = np.zeros(len(snapshot), dtype=bool)
+    for value in usable_status:
+        status |= snapshot.equals("status", value)
+    return mask & status
+
+
+# receivers of the given server types ("kiwi", "web", ...; see
+# kiwisdr_sources.py)
+def type_mask(snapshot, types):
+    mask = np.zeros(len(snapshot), dtype=bool)
+    for kind in types:
+        mask |= snapshot.equals("sdr_type", kind)
+    return mask
+
+
+# usable receivers with a channel free for one more listener
+def open_mask(snapshot, where=None):
+    mask = usable_mask(snapshot) & (
+        snapshot.array("users") < snapshot.array("users_max")
+    )
+    if where is not None:
+        mask &= where
+    return mask
+
+
+# one mask for the whole query.  Bounds are exclusive, as in the scripts:
+#   freq_range  (low, high) Hz the receiver must tune, converter included
+#   min_snr     SNR the receiver must exceed
+#   lat_range, lon_range  optional (low, high) box in degrees
+#   snr         which SNR figure to use (see snr_values())
+#   where       optional mask of receivers to consider at all
+def select_mask(
+    snapshot,
+    freq_range,
+    min_snr,
+    lat_range=None,
+    lon_range=None,
+    snr="snr_all",
+    where=None,
+):
+    mask = usable_mask(snapshot)
+    if where is not None:
+        mask &= where
+    mask &= coverage_index(snapshot).covering(freq_range[0] - 1, freq_range[1] + 1)
+    mask &= snr_values(snapshot, snr) > min_snr
+    mask &= snapshot.array("users") < snapshot.array("users_max")
+    if lat_range is not None:
+        lat = snapshot.array("lat")
+        mask &= (lat > lat_range[0]) & (lat < lat_range[1])
+    if lon_range is not None:
+        lon = snapshot.array("lon")
+        mask &= (lon > lon_range[0]) & (lon < lon_range[1])
+    return mask
+
+
+# frequencies (Hz) a receiver can actually tune: its band shifted by the
+# converter offset (kHz) of receivers fitted with one
+def coverage(snapshot):
+    offset = np.rint(snapshot.array("freq_offset") * 1000).astype(np.int64)
+    return snapshot.array("band_lo") + offset, snapshot.array("band_hi") + offset
+
+
+class CoverageIndex:
+    # which receivers can tune what, from coverage().  Receivers share few
+    # distinct coverage intervals (a few dozen in the list), so the index is
+    # over those: their ends cut the spectrum into segments, and the
+    # intervals covering each segment are worked out once.  The receivers
+    # covering a frequency are then a binary search for its segment away;
+    # a range is covered when both its ends are, as an interval has no
+    # holes.  Masks are cached per segment and shared: do not modify them.
+
+    def __init__(self, snapshot):
+        tune_lo, tune_hi = coverage(snapshot)
+        # distinct (low, high) pairs, numbered through the distinct ends
+        los, lo_code = np.unique(tune_lo, return_inverse=True)
+        his, hi_code = np.unique(tune_hi, return_inverse=True)
+        pairs, interval = np.unique(
+            lo_code.reshape(-1) * len(his) + hi_code.reshape(-1), return_inverse=True
+        )
+        self._interval = interval.reshape(-1)
+        self.lo = los[pairs // max(len(his), 1)]
+        self.hi = his[pairs % max(len(his), 1)]
+        # segment j runs from bounds[j] up to bounds[j + 1]
+        self.bounds = np.unique(np.concatenate([self.lo, self.hi + 1]))
+        self._covers = (self.lo[:, None] <= self.bounds) & (
+            self.hi[:, None] >= self.bounds
+        )
+        # receivers of each interval, in snapshot order
+        order = np.argsort(self._interval, kind="stable")
+        sizes = np.bincount(self._interval, minlength=len(pairs))
+        self._members = np.split(order, np.cumsum(sizes)[:-1])
+        self._nothing = np.zeros(len(self._interval), dtype=bool)
+        self._nothing.flags.writeable = False
+        self._masks = {}
+
+    def _segment(self, hz):
+        return int(np.searchsorted(self.bounds, hz, side="right")) - 1
+
+    def _mask(self, covered):
+        mask = covered[self._interval]
+        mask.flags.writeable = False
+        return mask
+
+    # receivers that can tune `hz`
+    def point(self, hz):
+        segment = self._segment(hz)
+        if segment < 0:
+            return self._nothing
+        mask = self._masks.get(segment)
+        if mask is None:
+            mask = self._masks[segment] = self._mask(self._covers[:, segment])
+        return mask
+
+    # receivers that can tune all of `low` to `high`
+    def covering(self, low, high):
+        if low > high:
+            return self._nothing
+        return self.point(low) & self.point(high)
+
+    # receivers that can tune some part of `low` to `high`
+    def overlapping(self, low, high):
+        first, last = max(self._segment(low), 0), self._segment(high)
+        if last < first:
+            return self._nothing
+        return self._mask(self._covers[:, first : last + 1].any(axis=1))
+
+    # row numbers of the receivers that can tune `hz`, in snapshot order;
+    # only the receivers found are touched
+    def rows(self, hz):
+        segment = self._segment(hz)
+        if segment < 0:
+            return np.zeros(0, dtype=np.intp)
+        found = [self._members[i] for i in np.flatnonzero(self._covers[:, segment])]
+        return np.sort(np.concatenate(found)) if found else np.zeros(0, np.intp)
+
+
+# the coverage index of a snapshot, built on first use
+def coverage_index(snapshot):
+    return snapshot.derived("coverage index", CoverageIndex)
+
+
+# the band table: (name, snr_limit, low_hz, high_hz, hf_weight) per line
+# of `path`.  hf_weight picks the SNR figure the band is judged by (see
+# snr_values()); 0, the all-band figure, when the column is missing.
+def load_bands(path):
+    bands = []
+    with open(path, newline="") as file:
+        for row in csv.reader(file):
+            if not row or row[0].lstrip().startswith("#"):
+                continue
+            name, snr_limit, low, high = (field.strip() for field in row[:4])
+            weight = float(row[4]) if len(row) > 4 and row[4].strip() else 0.0
+            bands.append((name, int(snr_limit), int(low), int(high), weight))
+    return bands
+
+
+class BandTable:
+    # the bands of a bands file cut into sorted segments that do not
+    # overlap, each naming the band it belongs to, so the band of a
+    # frequency is a binary search.  Band limits are inclusive.  Where bands
+    # overlap, the one listed last wins, as it did when the file was read
+    # top to bottom; the pairs are kept in `overlaps`.  Frequencies in no
+    # band have none.
+
+    def __init__(self, bands):
+        self.bands = list(bands)
+        edges = sorted(
+            {band[2] for band in self.bands} | {band[3] + 1 for band in self.bands}
+        )
+        self._starts = edges
+        self._owners = []
+        for start in edges:
+            owner = -1
+            for number, band in enumerate(self.bands):
+                if band[2] <= start <= band[3]:
+                    owner = number
+            self._owners.append(owner)
+        self.overlaps = [
+            (first[0], second[0])
+            for number, first in enumerate(self.bands)
+            for second in self.bands[number + 1 :]
+            if first[2] <= second[3] and second[2] <= first[3]
+        ]
+        # for numbers(): -1 before the first edge as well
+        self._owner_array = np.array([-1] + self._owners, dtype=np.intp)
+        self._start_array = np.array(edges, dtype=np.int64)
+
+    # the band (a load_bands() tuple) `hz` is in, or None
+    def band(self, hz):
+        segment = bisect.bisect_right(self._starts, hz) - 1
+        owner = self._owners[segment] if segment >= 0 else -1
+        return self.bands[owner] if owner >= 0 else None
+
+    # the band numbers (places in `bands`) of a whole array of frequencies
+    # at once; -1 for a frequency in no band
+    def numbers(self, hz):
+        segments = np.searchsorted(self._start_array, hz, side="right")
+        return self._owner_array[segments]
+
+
+# the region table: {name: [(south, north, west, east), ...]}; a region
+# may be made of several boxes
+def load_regions(path):
+    regions = {}
+    with open(path, newline="") as file:
+        for row in csv.reader(file):
+            if not row or row[0].lstrip().startswith("#"):
+                continue
+            box = tuple(float(field) for field in row[1:5])
+            regions.setdefault(row[0].strip(), []).append(box)
+    return regions
+
+
+# the SNR figure of every band as in snr_values(): its hf_weight, or `snr`
+# for all of them when given
+def band_snr(bands, snr=None):
+    if snr is not None:
+        return [snr] * len(bands)
+    return [band[4] if len(band) > 4 else 0.0 for band in bands]
+
+
+# one row of masks per band, all from a single pass over the columns.  A
+# receiver is listed for a band when it can tune all of it, by the same
+# rule as select_mask() (the band limits strictly inside its range), and
+# beats the band's SNR limit, by the band's own SNR figure unless `snr`
+# names one.
+# `bands` holds (name, snr_limit, low_hz, high_hz[, hf_weight]).
+def band_masks(snapshot, bands, snr=None, where=None):
+    bands = list(bands)
+    limits = np.array([band[1] for band in bands], dtype=np.float64)[:, None]
+    index = coverage_index(snapshot)
+    tunes = np.array([index.covering(band[2] - 1, band[3] + 1) for band in bands])
+    tunes = tunes.reshape(len(bands), len(snapshot))
+    figures = np.array([snr_values(snapshot, s) for s in band_snr(bands, snr)])
+    figures = figures.reshape(len(bands), len(snapshot))
+    base = open_mask(snapshot, where)
+    return base & tunes & (figures > limits)
+
+
+# best receivers of every band: {name: row numbers, best first}.  `key`
+# ranks as in rank(); a function of the band's SNR figure gives each band
+# its own key, e.g. a score whose SNR term is that figure.
+def band_lists(snapshot, bands, snr=None, limit=None, key=None, where=None, caps=None):
+    bands = list(bands)
+    lists = {}
+    masks = band_masks(snapshot, bands, snr, where)
+    for band, figure, mask in zip(bands, band_snr(bands, snr), masks):
+        band_key = key(figure) if callable(key) else key
+        lists[band[0]] = rank(snapshot, mask, figure, limit, band_key, caps)
+    return lists
+
+
+# integer group of each value, -1 for ""
+def _group_numbers(values):
+    numbers = {"": -1}
+    return np.array(
+        [numbers.setdefault(value, len(numbers) - 1) for value in values],
+        dtype=np.intp,
+    )
+
+
+# Maidenhead square of every receiver as (lon, lat) square numbers, 0-179
+# each (a square is 2 x 1 degrees): from the "grid" field, or from the GPS
+# position when the field is missing or malformed; -1 when neither is known
+def _squares(snapshot):
+    values, rows = snapshot.categories("grid")
+    lon_sq = np.full(len(values), -1)
+    lat_sq = np.full(len(values), -1)
+    for i, value in enumerate(values):
+        match = re.match(r"([A-R])([A-R])(\d)(\d)", value.upper())
+        if match:
+            lon_sq[i] = (ord(match[1]) - 65) * 10 + int(match[3])
+            lat_sq[i] = (ord(match[2]) - 65) * 10 + int(match[4])
+    lon_sq = lon_sq[rows] if len(values) else np.full(len(snapshot), -1)
+    lat_sq = lat_sq[rows] if len(values) else np.full(len(snapshot), -1)
+    lat, lon = snapshot.array("lat"), snapshot.array("lon")
+    located = (lon_sq < 0) & np.isfinite(lat) & np.isfinite(lon)
+    with np.errstate(invalid="ignore"):
+        lon_sq = np.where(located, np.clip((lon + 180) // 2, 0, 179), lon_sq)
+        lat_sq = np.where(located, np.clip(lat + 90, 0, 179), lat_sq)
+    return lon_sq.astype(np.intp), lat_sq.astype(np.intp)
+
+
+# groups receivers are spread over by the caps of rank(), one array each,
+# computed once per snapshot:
+#   host       site (host name): the channels of one multi-receiver site
+#   front_end  relay the receiver is reached through (kiwisdr_sources.py)
+#   square     Maidenhead grid square, 2 x 1 degrees
+#   field      Maidenhead field, 20 x 10 degrees, for a geographic spread
+def diversity_groups(snapshot):
+    def compute(snapshot):
+        urls, rows = snapshot.categories("url")
+        hosts = [site_key(url) for url in urls]
+        relays = [front_end(url, host) for url, host in zip(urls, hosts)]
+        lon_sq, lat_sq = _squares(snapshot)
+        known = lon_sq >= 0
+        return {
+            "host": _group_numbers(hosts)[rows],
+            "front_end": _group_numbers(relays)[rows],
+            "square": np.where(known, lon_sq * 180 + lat_sq, -1),
+            "field": np.where(known, lon_sq // 10 * 18 + lat_sq // 10, -1),
+        }
+
+    return snapshot.derived("diversity groups", compute)
+
+
+# row numbers passing `mask`, best SNR first, at most `limit` of them.
+# `key` (one value per receiver, e.g. kiwisdr_score.score()) ranks by
+# something else than SNR.  `caps` ({group: most receivers per group}, the
+# groups of diversity_groups()) keeps one site, relay or area from filling
+# the list; a receiver over a cap is left out and the next one moves up.
+def rank(snapshot, mask, snr="snr_all", limit=None, key=None, caps=None):
+    rows = np.flatnonzero(mask)
+    if key is None:
+        key = snr_values(snapshot, snr)
+    values = key[rows]
+    if not caps or not any(cap is not None for cap in caps.values()):
+        return rows[top_rows(values, limit)]
+    if limit is None:
+        return diverse(snapshot, rows[top_rows(values)], caps)
+    # the caps pass some receivers over: rank a few more than `limit`, and
+    # more only when that was not enough
+    size = 2 * limit
+    while True:
+        kept = diverse(snapshot, rows[top_rows(values, size)], caps, limit)
+        if len(kept) >= limit or size >= len(rows):
+            return kept
+        size *= 4
+
+
+# the first `limit` of `rows` (best first) within `caps`, as in rank()
+def diverse(snapshot, rows, caps, limit=None):
+    groups = diversity_groups(snapshot)
+    caps = [(groups[name], cap) for name, cap in (caps or {}).items()]
+    return capped_rows(np.asarray(rows, dtype=np.intp), caps, limit)
+
+
+class GridIndex:
+    # receivers on a grid of grid_cell degree cells, so a box only looks at
+    # the receivers in the cells it overlaps.  Cells are numbered row by row
+    # and the receivers sorted by cell, so a row of cells is a single slice.
+    # Receivers off the map are in the outermost cells; receivers without
+    # coordinates are in none.
+
+    def __init__(self, lat, lon, cell=None):
+        self._lat, self._lon = lat, lon
+        self._size = grid_cell if cell is None else cell
+        self._rows = math.ceil(180 / self._size)
+        self._cols = math.ceil(360 / self._size)
+        # 16 bit cell numbers where they fit, which numpy sorts in linear time
+        count = self._rows * self._cols + 1
+        kind = np.uint16 if count <= np.iinfo(np.uint16).max else np.intp
+        cells = np.full(len(lat), count - 1, dtype=kind)
+        known = np.isfinite(lat) & np.isfinite(lon)
+        row = np.floor((lat[known] + 90) / self._size).clip(0, self._rows - 1)
+        col = np.floor((lon[known] + 180) / self._size).clip(0, self._cols - 1)
+        cells[known] = row.astype(np.intp) * self._cols + col.astype(np.intp)
+        self._order = np.argsort(cells, kind="stable")
+        self._starts = np.searchsorted(cells[self._order], np.arange(count))
+
+    # the cell a bound falls in, as the receivers were put in them
+    def _cell(self, degrees, origin, count):
+        degrees = min(max(degrees, -origin), origin)
+        return min(max(math.floor((degrees + origin) / self._size), 0), count - 1)
+
+    # row numbers of the receivers inside a box, bounds exclusive, in no
+    # particular order
+    def inside(self, lat_range, lon_range):
+        if lat_range[0] >= lat_range[1] or lon_range[0] >= lon_range[1]:
+            return np.zeros(0, dtype=np.intp)
+        first, last = (self._cell(lat, 90, self._rows) for lat in lat_range)
+        west, east = (self._cell(lon, 180, self._cols) for lon in lon_range)
+        candidates = np.concatenate(
+            [
+                self._order[self._starts[row + west] : self._starts[row + east + 1]]
+                for row in range(first * self._cols, last * self._cols + 1, self._cols)
+            ]
+        )
+        lat, lon = self._lat[candidates], self._lon[candidates]
+        inside = (lat > lat_range[0]) & (lat < lat_range[1])
+        inside &= (lon > lon_range[0]) & (lon < lon_range[1])
+        return candidates[inside]
+
+
+# the GridIndex of a snapshot's receivers, built once per snapshot
+def grid_index(snapshot):
+    def compute(snapshot):
+        return GridIndex(snapshot.array("lat"), snapshot.array("lon"))
+
+    return snapshot.derived("grid index", compute)
+
+
+class SnrIndex:
+    # the receivers passing `mask`, best SNR first and equal SNR in snapshot
+    # order, as rank() lists them.  Built once per band; how many receivers
+    # of a region beat a threshold is then a binary search over the sorted
+    # SNR, so a threshold can be lowered step by step without filtering the
+    # snapshot again.  Boxes are looked up on the snapshot's grid_index().
+
+    def __init__(self, snapshot, mask, snr="snr_all"):
+        self.mask = mask
+        self.rows = rank(snapshot, mask, snr)
+        self.snr = snr_values(snapshot, snr)[self.rows]
+        self._snapshot = snapshot
+        self._position = None
+        self._regions = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    # (rows, snr) of the receivers inside a box, bounds exclusive, still
+    # best first
+    def region(self, lat_range=None, lon_range=None):
+        key = (
+            None if lat_range is None else tuple(lat_range),
+            None if lon_range is None else tuple(lon_range),
+        )
+        found = self._regions.get(key)
+        if found is None:
+            if self._position is None:
+                # place of every receiver in self.rows, -1 if not in it
+                self._position = np.full(len(self._snapshot), -1, dtype=np.intp)
+                self._position[self.rows] = np.arange(len(self.rows))
+            if not len(self.rows):
+                rows = self.rows
+            elif lat_range is not None and lon_range is not None:
+                rows = grid_index(self._snapshot).inside(lat_range, lon_range)
+            else:
+                lat, lon = self._snapshot.array("lat"), self._snapshot.array("lon")
+                inside = np.ones(len(self._snapshot), dtype=bool)
+                if lat_range is not None:
+                    inside &= (lat > lat_range[0]) & (lat < lat_range[1])
+                if lon_range is not None:
+                    inside &= (lon > lon_range[0]) & (lon < lon_range[1])
+                rows = np.flatnonzero(inside)
+            positions = self._position[rows]
+            positions = np.sort(positions[positions >= 0])
+            found = self._regions[key] = (self.rows[positions], self.snr[positions])
+        return found
+
+
+# how many of `values`, sorted best first, are above `threshold`
+def count_above(values, threshold):
+    return int(np.searchsorted(-values, -threshold, side="left"))
+
+
+# the SNR threshold giving a list of at least `target` of `values` (sorted
+# best first): `min_snr` when enough beat it, else `min_snr` lowered `step`
+# dB at a time until enough do, but not below `floor`
+def relaxed_threshold(values, min_snr, target, step, floor):
+    floor = min(floor, min_snr)
+    if count_above(values, min_snr) >= target:
+        return min_snr
+    if len(values) < target:
+        return floor
+    # the highest whole threshold the target-th receiver still beats
+    needed = math.ceil(values[target - 1]) - 1
+    steps = -(-(min_snr - needed) // step)
+    return max(min_snr - steps * step, floor)
+
+
+# row numbers of the best receivers for a query
+def select(
+    snapshot,
+    freq_range,
+    min_snr,
+    lat_range=None,
+    lon_range=None,
+    snr="snr_all",
+    limit=None,
+    key=None,
+    where=None,
+    caps=None,
+):
+    mask = select_mask(snapshot, freq_range, min_snr, lat_range, lon_range, snr, where)
+    return rank(snapshot, mask, snr, limit, key, caps)
+
+
+# select() one record at a time; the reference the vectorized path must
+# match.  `records` may be a stream, e.g. straight from the parser.
+def select_reference(
+    records,
+    freq_range,
+    min_snr,
+    lat_range=None,
+    lon_range=None,
+    snr="snr_all",
+    limit=None,
+    where=None,
+):
+    best = TopK(limit, key=lambda item: item[0])
+    for row, site in enumerate(records):
+        if where is not None and not where[row]:
+            continue
+        if site["offline"] or site["status"] not in usable_status:
+            continue
+        offset = round(site["freq_offset"] * 1000)
+        if not (
+            site["band_lo"] + offset < freq_range[0]
+            and site["band_hi"] + offset > freq_range[1]
+        ):
+            continue
+        value = _site_snr(site, snr)
+        if not (value > min_snr and site["users"] < site["users_max"]):
+            continue
+        if lat_range is not None and not lat_range[0] < site["lat"] < lat_range[1]:
+            continue
+        if lon_range is not None and not lon_range[0] < site["lon"] < lon_range[1]:
+            continue
+        best.push((value, row))
+    return [row for _, row in best.result()]
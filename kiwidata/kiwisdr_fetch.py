@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+
+# Conditional download of the receiver lists.
+#
+# The validators (ETag / Last-Modified) of the last download from each
+# mirror are kept in a small json file next to the list and sent back as
+# If-None-Match / If-Modified-Since, so an unchanged upstream list costs one
+# 304 round trip.  Bodies are accepted gzip or deflate compressed, streamed
+# to a temporary file and renamed over the old list only once they are
+# complete.  Every fetch appends its latency and byte counts to a json-lines
+# log.
+#
+# With several mirrors, fetch_hedged() asks the historically fastest one
+# first and, when it has not answered within a latency budget, asks the
+# next one as well.  The first valid response is published and the others
+# are cancelled.  Per-mirror latency and failure rates persist between runs.
+#
+#   ./kiwisdr_fetch.py DEST URL [URL ...]
+
+import json
+import os
+import sys
+import time
+
+from kiwisdr_io import atomic_write
+
+# default (connect, read) socket timeouts and total deadline, seconds
+timeout = (5, 30)
+deadline = 120
+chunk_size = 1 << 16
+# weight of the newest sample in the per-mirror moving averages
+stats_alpha = 0.3
+
+_session = None
+
+
+class FetchError(Exception):
+    pass
+
+
+# one pooled session per process; requests is imported on first use
+def get_session():
+    global _session
+    if _session is None:
+        import requests
+
+        _session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=4)
+        _session.mount("http://", adapter)
+        _session.mount("https://", adapter)
+        _session.headers["Accept-Encoding"] = "gzip, deflate"
+    return _session
+
+
+def meta_path(dest):
+    return f"{dest}.meta"
+
+
+def load_meta(dest):
+    try:
+        with open(meta_path(dest)) as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+# time of the last successful check (200 or 304), or 0
+def last_checked(dest):
+    checked = load_meta(dest).get("checked")
+    if checked is None:
+        try:
+            return os.path.getmtime(dest)
+        except OSError:
+            return 0
+    return checked
+
+
+def log_fetch(log_path, result):
+    if log_path:
+        with open(log_path, "a") as file:
+            file.write(json.dumps(result) + "\n")
+
+
+# fetch `url` into `dest` unless the server reports it unchanged.  Returns a
+# dict describing the fetch; raises FetchError when no usable list arrived.
+#   cancel     threading.Event; abandon the download once it is set
+#   responded  threading.Event; set as soon as response headers arrive
+#   claim      callable; the download is published only if it returns True
+def fetch(
+    url, dest, log_path=None, deadline=deadline, cancel=None, responded=None, claim=None
+):
+    meta = load_meta(dest)
+    validators = meta.get("validators", {}).get(url, {})
+    headers = {}
+    if os.path.exists(dest):
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+    result = {"time": time.time(), "url": url, "status": None}
+    start = time.monotonic()
+    temp_path = f"{dest}.tmp.{os.getpid()}.{id(result)}"
+    try:
+        response = get_session().get(url, headers=headers, stream=True, timeout=timeout)
+        with response:
+            result["ttfb_ms"] = round((time.monotonic() - start) * 1000, 1)
+            if responded is not None:
+                responded.set()
+            result["status"] = response.status_code
+            if response.status_code == 304:
+                result["state"] = "not modified"
+            elif response.status_code != 200:
+                raise FetchError(f"HTTP {response.status_code}")
+            else:
+                size = 0
+                with open(temp_path, "wb") as file:
+                    for chunk in response.iter_content(chunk_size):
+                        if time.monotonic() - start > deadline:
+                            raise FetchError(f"deadline of {deadline} s exceeded")
+                        if cancel is not None and cancel.is_set():
+                            raise FetchError("cancelled")
+                        file.write(chunk)
+                        size += len(chunk)
+                if size == 0:
+                    raise FetchError("empty response")
+                result["body_bytes"] = size
+                validators = {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                }
+            # bytes read off the wire, before decompression
+            result["wire_bytes"] = response.raw.tell()
+            if claim is not None and not claim():
+                raise FetchError("cancelled")
+            if response.status_code == 200:
+                os.replace(temp_path, dest)
+                result["state"] = "updated"
+    except Exception as exc:
+        result["state"] = "failed"
+        result["error"] = str(exc)
+        raise FetchError(f"{url}: {exc}") from exc
+    finally:
+        result["elapsed_ms"] = round((time.monotonic() - start) * 1000, 1)
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        log_fetch(log_path, result)
+
+    meta = load_meta(dest)
+    meta.setdefault("validators", {})[url] = validators
+    meta["url"] = url
+    meta["checked"] = time.time()
+    atomic_write(meta_path(dest), json.dumps(meta))
+    return result
+
+
+def load_stats(stats_path):
+    try:
+        with open(stats_path) as file:
+            return json.load(file)
+    except (FileNotFoundError, TypeError, ValueError):
+        return {}
+
+
+# fold one fetch outcome into the mirror's moving averages
+def update_stats(stats, url, latency_ms=None):
+    entry = stats.setdefault(url, {"latency_ms": None, "failure_rate": 0.0})
+    failed = latency_ms is None
+    entry["failure_rate"] += stats_alpha * (failed - entry["failure_rate"])
+    if not failed:
+        if entry["latency_ms"] is None:
+            entry["latency_ms"] = latency_ms
+        else:
+            entry["latency_ms"] += stats_alpha * (latency_ms - entry["latency_ms"])
+    entry["last"] = time.time()
+
+
+# mirrors ordered by expected cost; unmeasured mirrors keep config order
+# after the measured ones
+def rank_mirrors(urls, stats):
+    def cost(item):
+        index, url = item
+        entry = stats.get(url)
+        if not entry or entry.get("latency_ms") is None:
+            return (1, 0, index)
+        return (0, entry["latency_ms"] * (1 + 4 * entry["failure_rate"]), index)
+
+    return [url for _, url in sorted(enumerate(urls), key=cost)]
+
+
+# hedged fetch across mirrors: start with the best ranked mirror and add the
+# next one whenever nothing has answered within `budget` seconds (or a
+# mirror failed).  The first valid response wins; the rest are cancelled.
+def fetch_hedged(
+    urls, dest, log_path=None, deadline=deadline, budget=1.0, stats_path=None
+):
+    # imported here: stripper's fast path reads freshness from this module
+    import queue
+    import threading
+
+    stats = load_stats(stats_path)
+    order = rank_mirrors(urls, stats)
+    cancel = threading.Event()
+    results = queue.Queue()
+    winner = []
+    winner_lock = threading.Lock()
+
+    def claim():
+        with winner_lock:
+            if winner or cancel.is_set():
+                return False
+            winner.append(True)
+            return True
+
+    def worker(url, responded):
+        try:
+            result = fetch(url, dest, log_path, deadline, cancel, responded, claim)
+            results.put((url, result, None))
+        except FetchError as exc:
+            results.put((url, None, exc))
+
+    responses = []
+    errors = []
+    running = 0
+    start = time.monotonic()
+
+    def launch():
+        nonlocal running
+        url = order[len(responses)]
+        responded = threading.Event()
+        responses.append(responded)
+        running += 1
+        # daemon threads: a cancelled mirror stuck in connect must not keep
+        # the process alive after the winner is published
+        threading.Thread(target=worker, args=(url, responded), daemon=True).start()
+
+    launch()
+    hedge_at = start + budget
+    try:
+        while running:
+            now = time.monotonic()
+            if now - start > deadline:
+                raise FetchError(f"deadline of {deadline} s exceeded")
+            wait = deadline - (now - start)
+            if len(responses) < len(order):
+                wait = min(wait, max(hedge_at - now, 0))
+            try:
+                url, result, error = results.get(timeout=wait)
+            except queue.Empty:
+                # budget spent: hedge unless a mirror is already sending
+                if len(responses) < len(order):
+                    if not any(event.is_set() for event in responses):
+                        launch()
+                    hedge_at = time.monotonic() + budget
+                continue
+            running -= 1
+            if error is None:
+                update_stats(stats, url, result["ttfb_ms"])
+                result["mirror_rank"] = order.index(url)
+                return result
+            if str(error).endswith("cancelled"):
+                continue
+            update_stats(stats, url, None)
+            errors.append(str(error))
+            if len(responses) < len(order):
+                launch()
+                hedge_at = time.monotonic() + budget
+        raise FetchError("all mirrors failed: " + "; ".join(errors))
+    finally:
+        cancel.set()
+        if stats_path:
+            atomic_write(stats_path, json.dumps(stats, indent=1))
+
+
+if __name__ == "__main__":
+    try:
+        print(json.dumps(fetch_hedged(sys.argv[2:], sys.argv[1])))
+    except FetchError as exc:
+        print(exc, file=sys.stderr)
+        sys.exit(1)
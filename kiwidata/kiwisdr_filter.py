@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+
+# Receiver filter expressions.
+#
+# A filter is a list of conditions separated by spaces, all of which must
+# hold:
+#
+#   snr>=20 free_slots>0 hw~"Web-888" band=Shortwave within(region=Tokyo)
+#
+#   FIELD OP VALUE   OP is one of = != > >= < <=, or ~ (regular expression
+#                    search, case insensitive, strings only).  FIELD is any
+#                    snapshot column or one of the names in `aliases`;
+#                    free_slots is users_max - users and reliability
+#                    the score kept by kiwisdr_reliability.py (0-1).
+#   band=NAME        can tune all of a band in the bands file, as the band
+#                    lists of kiwisdr_catalog.band_masks() take them
+#   freq=KHZ         can tune the frequency (kHz, as in the stations file)
+#   covers=LOW-HIGH  can tune all of LOW to HIGH kHz
+#                    (band, freq and covers count a converter's offset)
+#   within(region=NAME)               inside a region of the regions file
+#   within(SOUTH, NORTH, WEST, EAST)  inside a lat/lon box
+#
+# An expression is compiled once into a list of vectorized predicates and
+# kept by its text, so the sorters can evaluate the same filter over and
+# over; the mask it computes is kept with the snapshot as well.
+#
+#   ./kiwisdr_filter.py EXPRESSION [--top N] [snapshot]
+
+import re
+
+import numpy as np
+from kiwisdr_catalog import (
+    coverage_index,
+    load_bands,
+    load_regions,
+    rank,
+    usable_mask,
+)
+from kiwisdr_parser import string_fields
+from kiwisdr_reliability import reliability
+from kiwisdr_snapshot import NUMERIC_COLUMNS
+
+band_file = "/usr/local/src/kiwidata/bands"
+region_file = "/usr/local/src/kiwidata/regions"
+snapshot_file = "/usr/local/src/kiwidata/kiwisdr_stripped.snap"
+
+aliases = {
+    "snr": "snr_all",
+    "hw": "sdr_hw",
+    "type": "sdr_type",
+    "version": "sw_version",
+}
+numeric_fields = {name for name, _ in NUMERIC_COLUMNS} | {"free_slots", "reliability"}
+
+_condition = re.compile(
+    r"""\s*(?:
+        (?P<function>[A-Za-z_]\w*)\((?P<args>[^)]*)\)
+      | (?P<field>[A-Za-z_]\w*)\s*(?P<op>>=|<=|!=|=|>|<|~)\s*
+        (?P<value>"[^"]*"|'[^']*'|[^\s"'()]+)
+    )(?=\s|$)""",
+    re.VERBOSE,
+)
+_compare = {
+    "=": np.equal,
+    "!=": np.not_equal,
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "<": np.less,
+    "<=": np.less_equal,
+}
+_compiled = {}
+
+
+class FilterError(ValueError):
+    pass
+
+
+class Filter:
+    # a compiled expression: mask(snapshot) is the conjunction of its
+    # predicates, computed once per snapshot
+
+    def __init__(self, text, predicates):
+        self.text = text
+        self._predicates = predicates
+
+    def __repr__(self):
+        return f"Filter({self.text!r})"
+
+    def mask(self, snapshot):
+        def compute(snapshot):
+            mask = np.ones(len(snapshot), dtype=bool)
+            for predicate in self._predicates:
+                mask &= predicate(snapshot)
+            return mask
+
+        return snapshot.derived(f"filter {self.text}", compute)
+
+
+def _unquote(value):
+    if value[:1] in "\"'" and value[-1:] == value[:1]:
+        return value[1:-1]
+    return value
+
+
+def _number(text, value):
+    try:
+        return float(value)
+    except ValueError:
+        raise FilterError(f"{text!r}: {value!r} is not a number") from None
+
+
+def _numeric(field):
+    if field == "free_slots":
+        return lambda snapshot: snapshot.array("users_max") - snapshot.array("users")
+    if field == "reliability":
+        return reliability
+    return lambda snapshot: snapshot.array(field)
+
+
+def _string_predicate(text, field, op, value):
+    if op == "~":
+        try:
+            pattern = re.compile(value, re.IGNORECASE)
+        except re.error as exc:
+            raise FilterError(f"{text!r}: bad pattern {value!r}: {exc}") from None
+
+        # one search per distinct value, not per receiver
+        def search(snapshot):
+            values, rows = snapshot.categories(field)
+            hits = np.array([bool(pattern.search(v)) for v in values], dtype=bool)
+            return hits[rows] if len(values) else np.zeros(len(snapshot), dtype=bool)
+
+        return search
+    if op == "=":
+        return lambda snapshot: snapshot.equals(field, value)
+    if op == "!=":
+        return lambda snapshot: ~snapshot.equals(field, value)
+    raise FilterError(f"{text!r}: {field} is text; use =, != or ~")
+
+
+def _band_predicate(text, op, value):
+    bands = {band[0].lower(): band for band in load_bands(band_file)}
+    band = bands.get(value.lower())
+    if band is None or op not in ("=", "!="):
+        raise FilterError(f"{text!r}: expected band=NAME with a band from {band_file}")
+    low, high = band[2], band[3]
+
+    def tunes(snapshot):
+        return coverage_index(snapshot).covering(low - 1, high + 1)
+
+    return tunes if op == "=" else lambda snapshot: ~tunes(snapshot)
+
+
+def _freq_predicate(text, op, value):
+    if op != "=":
+        raise FilterError(f"{text!r}: expected freq=KHZ")
+    hz = round(_number(text, value) * 1000)
+    return lambda snapshot: coverage_index(snapshot).point(hz)
+
+
+def _covers_predicate(text, op, value):
+    low, _, high = value.partition("-")
+    if op != "=" or not high:
+        raise FilterError(f"{text!r}: expected covers=LOW-HIGH in kHz")
+    low, high = (round(_number(text, edge) * 1000) for edge in (low, high))
+    return lambda snapshot: coverage_index(snapshot).covering(low, high)
+
+
+def _within(text, args):
+    args = [arg.strip() for arg in args.split(",") if arg.strip()]
+    if len(args) == 1 and args[0].startswith("region="):
+        name = _unquote(args[0].split("=", 1)[1].strip())
+        regions = {
+            key.lower(): boxes for key, boxes in load_regions(region_file).items()
+        }
+        if name.lower() not in regions:
+            raise FilterError(f"{text!r}: no region {name!r} in {region_file}")
+        boxes = regions[name.lower()]
+    elif len(args) == 4:
+        boxes = [tuple(_number(text, arg) for arg in args)]
+    else:
+        raise FilterError(
+            f"{text!r}: expected within(region=NAME) or within(S, N, W, E)"
+        )
+
+    def inside(snapshot):
+        lat, lon = snapshot.array("lat"), snapshot.array("lon")
+        mask = np.zeros(len(snapshot), dtype=bool)
+        for south, north, west, east in boxes:
+            mask |= (lat > south) & (lat < north) & (lon > west) & (lon < east)
+        return mask
+
+    return inside
+
+
+def _predicate(text, match):
+    if match["function"]:
+        if match["function"] != "within":
+            raise FilterError(f"{text!r}: unknown function {match['function']}()")
+        return _within(text, match["args"])
+    field, op, value = match["field"], match["op"], _unquote(match["value"])
+    field = aliases.get(field, field)
+    if field == "band":
+        return _band_predicate(text, op, value)
+    if field == "freq":
+        return _freq_predicate(text, op, value)
+    if field == "covers":
+        return _covers_predicate(text, op, value)
+    if field in string_fields:
+        return _string_predicate(text, field, op, value)
+    if field not in numeric_fields:
+        raise FilterError(f"{text!r}: unknown field {field!r}")
+    if op == "~":
+        raise FilterError(f"{text!r}: {field} is a number; ~ is for text")
+    column, compare, number = _numeric(field), _compare[op], _number(text, value)
+    return lambda snapshot: compare(column(snapshot), number)
+
+
+# compile `text` into a Filter, or return the one compiled before
+def compile_filter(text):
+    compiled = _compiled.get(text)
+    if compiled is None:
+        predicates = []
+        pos = 0
+        while text[pos:].strip():
+            match = _condition.match(text, pos)
+            if match is None:
+                raise FilterError(f"cannot parse {text[pos:].strip()!r}")
+            predicates.append(_predicate(match.group(0).strip(), match))
+            pos = match.end()
+        compiled = _compiled[text] = Filter(text, predicates)
+    return compiled
+
+
+# row numbers of the usable receivers matching `text`, best first
+def query(snapshot, text, snr="snr_all", limit=None, key=None, where=None, caps=None):
+    mask = usable_mask(snapshot) & compile_filter(text).mask(snapshot)
+    if where is not None:
+        mask &= where
+    return rank(snapshot, mask, snr, limit, key, caps)
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    from kiwisdr_snapshot import load_snapshot
+
+    parser = argparse.ArgumentParser(description="List receivers matching a filter.")
+    parser.add_argument("expression")
+    parser.add_argument("snapshot", nargs="?", default=snapshot_file)
+    parser.add_argument("--top", type=int, default=None, help="best N only")
+    args = parser.parse_args()
+
+    snapshot = load_snapshot(args.snapshot)
+    try:
+        rows = query(snapshot, args.expression, limit=args.top)
+    except FilterError as exc:
+        print(exc, file=sys.stderr)
+        sys.exit(2)
+    urls, places = snapshot.strings("url"), snapshot.strings("loc")
+    snr = snapshot.array("snr_all")
+    for row in rows:
+        print(f"{snr[row]:>4} {urls[row]:<48} {places[row]}")
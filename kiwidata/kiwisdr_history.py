@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+
+# Receiver history.
+#
+# Every new snapshot appends one frame to history/raw: the numeric fields
+# of each receiver (SNR, users, uptime, ADC overloads, online) at that time.
+# Receivers are numbered once, in history/receivers (one url per line, in
+# order of first appearance), so a frame only holds numbers.  A frame is a
+# small header followed by its columns, one after the other and each split
+# into byte planes, compressed with zlib; appending one is a single write
+# at the end of the file.
+#
+# Raw frames older than raw_days are rolled up into one frame per hour in
+# history/hourly, hourly frames older than hourly_days into one per day in
+# history/daily, and daily frames older than daily_days are dropped.  A
+# rollup keeps, per receiver, the number of samples and how many were
+# online, the mean SNR and users and the highest uptime and overload count.
+# Rollups are cut at whole days, so an hour or day is never split over two
+# frames, and so they run at most once a day: the file being rolled up is
+# then rewritten without its old frames.
+#
+# Queries read the frame headers first and decompress only the frames in
+# the time range asked for.
+#
+#   ./kiwisdr_history.py [--url URL] [--days N] [--level LEVEL] [history_dir]
+
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+from kiwisdr_io import atomic_write
+
+history_dir = "/usr/local/src/kiwidata/history"
+# days kept at each resolution
+raw_days = 7
+hourly_days = 30
+daily_days = 730
+
+levels = ("raw", "hourly", "daily")
+_seconds = {"raw": 0, "hourly": 3600, "daily": 86400}
+
+# one sample of one receiver
+raw_fields = (
+    ("receiver", "<u4"),
+    ("snr_all", "<i2"),
+    ("snr_hf", "<i2"),
+    ("users", "<i2"),
+    ("users_max", "<i2"),
+    ("uptime", "<u4"),
+    ("adc_ov", "<u8"),
+    ("online", "u1"),
+)
+# one receiver over an hour or a day
+rollup_fields = (
+    ("receiver", "<u4"),
+    ("samples", "<u2"),
+    ("online", "<u2"),
+    ("snr_all", "<i2"),
+    ("snr_hf", "<i2"),
+    ("users", "<u2"),
+    ("users_max", "<i2"),
+    ("uptime", "<u4"),
+    ("adc_ov", "<u8"),
+)
+# means are stored in fixed point (tenths of a dB, hundredths of a user),
+# which compresses far better than floats
+_scale = {"snr_all": 10, "snr_hf": 10, "users": 100}
+# what queries return: rollup fields, means as floats, and the start of the
+# sample's period
+record_dtype = np.dtype(
+    [("time", "<f8")]
+    + [(name, "<f4" if name in _scale else dtype) for name, dtype in rollup_fields]
+)
+
+MAGIC = b"KHF1"
+# magic, time, snapshot generation, receivers, compressed length
+_frame = struct.Struct("<4sdQII")
+
+
+def _fields(level):
+    return raw_fields if level == "raw" else rollup_fields
+
+
+def _encode(columns, level):
+    blocks = []
+    for name, dtype in _fields(level):
+        values = columns[name]
+        if level != "raw" and name in _scale:
+            values = np.rint(values * _scale[name])
+        values = np.ascontiguousarray(values, dtype=dtype)
+        # byte planes: the high bytes of a column are mostly alike
+        blocks.append(values.view(np.uint8).reshape(-1, values.itemsize).T.tobytes())
+    return zlib.compress(b"".join(blocks), 6)
+
+
+# the columns of a frame; of one receiver's row only when `receiver` is
+# given, which then is the only row rebuilt from the byte planes
+def _decode(payload, count, level, receiver=None):
+    data = zlib.decompress(payload)
+    columns = {}
+    offset = 0
+    rows = slice(None)
+    for name, dtype in _fields(level):
+        dtype = np.dtype(dtype)
+        planes = np.frombuffer(data, np.uint8, dtype.itemsize * count, offset)
+        planes = planes.reshape(dtype.itemsize, count)[:, rows]
+        columns[name] = planes.T.copy().view(dtype).reshape(-1)
+        if name == "receiver" and receiver is not None:
+            rows = np.flatnonzero(columns[name] == receiver)
+            columns[name] = columns[name][rows]
+        if level != "raw" and name in _scale:
+            columns[name] = columns[name] / _scale[name]
+        offset += dtype.itemsize * count
+    return columns
+
+
+# raw columns as rollup columns of one sample each
+def _as_rollup(columns):
+    count = len(columns["receiver"])
+    rollup = {name: columns[name] for name, _ in rollup_fields if name in columns}
+    rollup["samples"] = np.ones(count, dtype=np.uint16)
+    rollup["online"] = columns["online"].astype(np.uint16)
+    return rollup
+
+
+# merge rollup columns into one row per receiver: counts add up, means are
+# weighted by samples, uptime and overloads keep their highest value
+def _aggregate(parts):
+    receiver = np.concatenate([part["receiver"] for part in parts])
+    numbers, group = np.unique(receiver, return_inverse=True)
+    samples = np.concatenate([part["samples"] for part in parts]).astype(np.float64)
+    weight = np.bincount(group, samples, len(numbers))
+    merged = {"receiver": numbers, "samples": weight}
+    merged["online"] = np.bincount(
+        group, np.concatenate([part["online"] for part in parts]), len(numbers)
+    )
+    for name in ("snr_all", "snr_hf", "users"):
+        values = np.concatenate([part[name] for part in parts]) * samples
+        merged[name] = np.bincount(group, values, len(numbers)) / weight
+    for name in ("users_max", "uptime", "adc_ov"):
+        values = np.concatenate([part[name] for part in parts])
+        highest = np.zeros(len(numbers), dtype=values.dtype)
+        np.maximum.at(highest, group, values)
+        merged[name] = highest
+    merged["samples"] = np.minimum(weight, 65535)
+    merged["online"] = np.minimum(merged["online"], 65535)
+    return merged
+
+
+class History:
+    # the history directory: receiver numbers and one frame file per level
+
+    def __init__(self, path=history_dir):
+        self.path = path
+        self._receivers = None
+
+    def _file(self, level):
+        return os.path.join(self.path, level)
+
+    # {url: receiver number}, read on first use
+    def receivers(self):
+        if self._receivers is None:
+            self._receivers = {}
+            try:
+                with open(self._file("receivers"), encoding="utf-8") as file:
+                    for line in file:
+                        self._receivers[line.rstrip("\n")] = len(self._receivers)
+            except FileNotFoundError:
+                pass
+        return self._receivers
+
+    # receiver numbers of `urls`, numbering the new ones
+    def _numbers(self, urls):
+        known = self.receivers()
+        new = [url for url in dict.fromkeys(urls) if url not in known]
+        if new:
+            with open(self._file("receivers"), "a", encoding="utf-8") as file:
+                file.writelines(f"{url}\n" for url in new)
+            for url in new:
+                known[url] = len(known)
+        return np.array([known[url] for url in urls], dtype=np.uint32)
+
+    # (time, generation, count, offset, length) of every frame of a level,
+    # and the contents of its file
+    def frames(self, level):
+        try:
+            with open(self._file(level), "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return [], b""
+        found = []
+        offset = 0
+        while offset + _frame.size <= len(data):
+            magic, when, generation, count, length = _frame.unpack_from(data, offset)
+            start = offset + _frame.size
+            if magic != MAGIC or start + length > len(data):
+                # a frame cut short by a crash: ignore it and what follows
+                break
+            found.append((when, generation, count, start, length))
+            offset = start + length
+        return found, data
+
+    # time of the oldest frame of a level, from its first header only
+    def _oldest(self, level):
+        try:
+            with open(self._file(level), "rb") as file:
+                head = file.read(_frame.size)
+        except FileNotFoundError:
+            return None
+        if len(head) < _frame.size or head[:4] != MAGIC:
+            return None
+        return _frame.unpack(head)[1]
+
+    def _append(self, level, when, generation, columns):
+        payload = _encode(columns, level)
+        count = len(columns["receiver"])
+        with open(self._file(level), "ab") as file:
+            file.write(_frame.pack(MAGIC, when, generation, count, len(payload)))
+            file.write(payload)
+
+    # add a snapshot to the history, unless it is the one added last.
+    # Returns True when a frame was written.
+    def append(self, snapshot, now=None):
+        now = time.time() if now is None else now
+        os.makedirs(self.path, exist_ok=True)
+        frames, data = self.frames("raw")
+        if frames and frames[-1][1] == snapshot.generation and snapshot.generation:
+            return False
+        end = frames[-1][3] + frames[-1][4] if frames else 0
+        if end < len(data):
+            # drop the remains of an interrupted append
+            os.truncate(self._file("raw"), end)
+        columns = {"receiver": self._numbers(snapshot.strings("url"))}
+        for name in ("snr_all", "snr_hf", "users", "users_max"):
+            columns[name] = np.clip(snapshot.array(name), -32768, 32767)
+        columns["uptime"] = np.clip(snapshot.array("uptime"), 0, 2**32 - 1)
+        columns["adc_ov"] = np.maximum(snapshot.array("adc_ov"), 0)
+        columns["online"] = snapshot.array("offline") == 0
+        self._append("raw", now, snapshot.generation, columns)
+        self.roll_up(now)
+        return True
+
+    # move frames past their retention one level down: raw into hourly,
+    # hourly into daily, and drop old daily frames
+    def roll_up(self, now=None):
+        now = time.time() if now is None else now
+        for level, coarser in zip(levels, levels[1:] + (None,)):
+            # cut at the start of a day
+            days = {"raw": raw_days, "hourly": hourly_days, "daily": daily_days}[level]
+            cutoff = (now - days * 86400) // 86400 * 86400
+            oldest = self._oldest(level)
+            if oldest is None or oldest >= cutoff:
+                continue
+            frames, data = self.frames(level)
+            old = [frame for frame in frames if frame[0] < cutoff]
+            kept = [frame for frame in frames if frame[0] >= cutoff]
+            if coarser is not None:
+                self._roll_into(coarser, old, data, level)
+            atomic_write(
+                self._file(level),
+                b"".join(
+                    data[start - _frame.size : start + length]
+                    for *_, start, length in kept
+                ),
+            )
+
+    def _roll_into(self, coarser, frames, data, level):
+        period = _seconds[coarser]
+        buckets = {}
+        for when, generation, count, start, length in frames:
+            columns = _decode(data[start : start + length], count, level)
+            if level == "raw":
+                columns = _as_rollup(columns)
+            buckets.setdefault(when // period * period, []).append(columns)
+        for when, parts in sorted(buckets.items()):
+            self._append(coarser, when, 0, _aggregate(parts))
+
+    # records between `start` and `end` (epoch seconds, either may be None)
+    # at the given levels, oldest first, for one receiver (its url) or all
+    def query(self, start=None, end=None, url=None, at=levels):
+        receiver = None
+        if url is not None:
+            receiver = self.receivers().get(url)
+            if receiver is None:
+                return np.zeros(0, dtype=record_dtype)
+        parts = []
+        for level in at:
+            frames, data = self.frames(level)
+            for when, generation, count, offset, length in frames:
+                if (start is not None and when < start) or (
+                    end is not None and when >= end
+                ):
+                    continue
+                payload = data[offset : offset + length]
+                columns = _decode(payload, count, level, receiver)
+                if level == "raw":
+                    columns = _as_rollup(columns)
+                part = np.zeros(len(columns["receiver"]), dtype=record_dtype)
+                part["time"] = when
+                for name, _ in rollup_fields:
+                    part[name] = columns[name]
+                parts.append(part)
+        if not parts:
+            return np.zeros(0, dtype=record_dtype)
+        records = np.concatenate(parts)
+        return records[np.argsort(records["time"], kind="stable")]
+
+    # bytes on disk per file
+    def sizes(self):
+        sizes = {}
+        for name in ("receivers",) + levels:
+            try:
+                sizes[name] = os.path.getsize(self._file(name))
+            except FileNotFoundError:
+                sizes[name] = 0
+        return sizes
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Print receiver history.")
+    parser.add_argument("history", nargs="?", default=history_dir)
+    parser.add_argument("--url", help="one receiver (its url) instead of all")
+    parser.add_argument("--days", type=float, default=None, help="last N days only")
+    parser.add_argument("--level", choices=levels, action="append")
+    args = parser.parse_args()
+
+    history = History(args.history)
+    start = time.time() - args.days * 86400 if args.days else None
+    records = history.query(start, url=args.url, at=args.level or levels)
+    if args.url:
+        print(
+            f"{'time':<17} {'samples':>7} {'online':>6} {'snr':>5} {'hf':>5} {'users':>5}"
+        )
+        for record in records:
+            stamp = time.strftime("%Y-%m-%d %H:%M", time.localtime(record["time"]))
+            print(
+                f"{stamp:<17} {record['samples']:>7} {record['online']:>6}"
+                f" {record['snr_all']:>5.1f} {record['snr_hf']:>5.1f}"
+                f" {record['users']:>5.1f}"
+            )
+    else:
+        # one line per period: receivers seen, share online, mean snr
+        times, first = np.unique(records["time"], return_index=True)
+        print(f"{'time':<17} {'receivers':>9} {'online':>7} {'snr':>5}")
+        for when, part in zip(times, np.split(records, first[1:])):
+            stamp = time.strftime("%Y-%m-%d %H:%M", time.localtime(when))
+            online = part["online"].sum() / max(part["samples"].sum(), 1)
+            print(
+                f"{stamp:<17} {len(part):>9} {online:>7.1%}"
+                f" {part['snr_all'].mean():>5.1f}"
+            )
+    for name, size in history.sizes().items():
+        print(f"# {name}: {size / 1024:.1f} kB")
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+# File helpers shared by stripper and the sorters.  Outputs are written to a
+# temporary file in the same directory and renamed over the old one, so the
+# wrapper's menus always read either the previous list or the new one, never
+# a half written file.  Writing (stage) and renaming (publish) are separate
+# steps, so the build can write several outputs and rename them together.
+#
+# Refreshes are single-flight: the process holding the refresh lock rebuilds
+# the outputs and then publishes a new generation manifest; everyone else
+# waits for that generation or keeps using the previous one.  Readers never
+# take the lock.
+#
+# The manifest also records the size, mtime and sha1 of every input of the
+# generation, so a run with nothing new to do can be recognised from a few
+# stat() calls and exit before importing anything heavy.
+
+import fcntl
+import json
+import os
+import time
+
+
+# write `data` to a temporary file next to `path` and return its name, for
+# publish() to rename into place.  `data` is str, bytes, or an iterable of
+# str such as a generator of lines, which is written through one buffered
+# handle as it is produced, so the whole text never has to be in memory.
+def stage(path, data):
+    temp_path = f"{path}.tmp.{os.getpid()}"
+    try:
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            with open(temp_path, "wb") as file:
+                file.write(data)
+        else:
+            with open(temp_path, "w") as file:
+                if isinstance(data, str):
+                    file.write(data)
+                else:
+                    file.writelines(data)
+    except BaseException:
+        discard(temp_path)
+        raise
+    return temp_path
+
+
+def publish(temp_path, path):
+    try:
+        os.replace(temp_path, path)
+    except BaseException:
+        discard(temp_path)
+        raise
+
+
+def discard(temp_path):
+    try:
+        os.unlink(temp_path)
+    except FileNotFoundError:
+        pass
+
+
+def atomic_write(path, data):
+    publish(stage(path, data), path)
+
+
+# try to take the exclusive refresh lock; returns the lock fd or None
+def try_lock(path):
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+# wait up to `timeout` seconds for the refresh lock; returns the fd or None
+def wait_lock(path, timeout):
+    give_up = time.monotonic() + timeout
+    while True:
+        fd = try_lock(path)
+        if fd is not None or time.monotonic() > give_up:
+            return fd
+        time.sleep(0.1)
+
+
+def release_lock(fd):
+    fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
+
+
+def lock_held(path):
+    fd = try_lock(path)
+    if fd is None:
+        return True
+    release_lock(fd)
+    return False
+
+
+def read_generation(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {"generation": 0, "outputs": {}}
+
+
+def file_digest(path):
+    import hashlib
+
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_signature(path, digest=True):
+    stat = os.stat(path)
+    signature = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if digest:
+        signature["sha1"] = file_digest(path)
+    return signature
+
+
+# True when a recorded signature still describes the file.  Only the stat
+# fields are compared unless they differ; then the content hash decides, so
+# a file that was touched or rewritten with the same bytes still matches.
+def signature_matches(path, recorded):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return False
+    if (stat.st_size, stat.st_mtime_ns) == (recorded["size"], recorded["mtime_ns"]):
+        return True
+    if stat.st_size != recorded["size"] or "sha1" not in recorded:
+        return False
+    return file_digest(path) == recorded["sha1"]
+
+
+# True when every input is unchanged since the last published generation
+# and all of its outputs are still in place
+def generation_current(manifest, inputs):
+    recorded = manifest.get("inputs", {})
+    for path in inputs:
+        if path not in recorded or not signature_matches(path, recorded[path]):
+            return False
+    return bool(manifest.get("outputs")) and all(
+        os.path.exists(path) for path in manifest["outputs"]
+    )
+
+
+# record a completed refresh: its generation number, the signatures of the
+# inputs it was built from and of every output it published
+def publish_generation(path, generation, outputs, inputs=()):
+    manifest = {
+        "generation": generation,
+        "time": time.time(),
+        "inputs": {},
+        "outputs": {},
+    }
+    for name, paths, digest in (("inputs", inputs, True), ("outputs", outputs, False)):
+        for file_path in paths:
+            try:
+                manifest[name][file_path] = file_signature(file_path, digest)
+            except FileNotFoundError:
+                continue
+    atomic_write(path, json.dumps(manifest, indent=1))
+    return manifest
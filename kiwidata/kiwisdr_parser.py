@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+# Streaming parser for Dyatlov's kiwisdr_com.js and the user's static_rx.js.
+#
+# Both files are a javascript array of flat objects, one "key":"value" pair
+# per line:
+#
+#     var kiwisdr_com =
+#     [
+#         {
+#             "name":"...",
+#             "gps":"(51.317266, -2.950479)",
+#             ...
+#         },
+#     ]
+#     ;
+#
+# The file is read in chunks and every object is decoded on its own, so
+# memory stays bounded by the chunk size no matter how long the list grows.
+# A record ends at a line holding only its closing brace; its text is
+# decoded with the C json scanner after dropping a javascript style trailing
+# comma.  Records the scanner rejects are reported as malformed and skipped
+# instead of breaking the whole list.  Records are yielded with typed fields.
+#
+#   ./kiwisdr_parser.py kiwisdr_com.js
+
+import json
+import math
+import re
+import sys
+
+chunk_size = 1 << 20
+
+_decode = json.JSONDecoder().decode
+_record_end = re.compile(r"\n[ \t]*\},?[ \t]*(?=\r?\n|$)")
+_trailing_comma = re.compile(r",(\s*\})")
+
+
+def _int(value, default=0):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        try:
+            return int(float(value))
+        except (TypeError, ValueError):
+            return default
+
+
+def _float(value, default=math.nan):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+# a field as text whatever json type it came as; "" for null
+def _text(value):
+    return "" if value is None else str(value)
+
+
+# string fields carried over verbatim ("source" and "sdr_type" are filled
+# in when lists are merged, see kiwisdr_sources.py)
+string_fields = (
+    "id",
+    "name",
+    "url",
+    "loc",
+    "grid",
+    "sdr_hw",
+    "sw_version",
+    "antenna",
+    "status",
+    "source",
+    "sdr_type",
+)
+
+
+# convert one receiver dict of strings into a dict of typed values; fields
+# of another json type (numbers, null) are read as their text
+def typed_fields(site):
+    get = site.get
+    try:
+        lat, lon = _text(get("gps")).strip("() ").split(",")
+        lat, lon = float(lat), float(lon)
+    except ValueError:
+        lat = lon = math.nan
+    try:
+        band_lo, band_hi = _text(get("bands")).split("-")[:2]
+        band_lo, band_hi = int(band_lo), int(band_hi)
+    except ValueError:
+        band_lo = band_hi = 0
+    snr = _text(get("snr")).split(",")
+    snr_all = _int(snr[0])
+    snr_hf = _int(snr[1], snr_all) if len(snr) > 1 else snr_all
+    fields = {
+        "lat": lat,
+        "lon": lon,
+        "band_lo": band_lo,
+        "band_hi": band_hi,
+        "freq_offset": _float(get("freq_offset"), 0.0),
+        "users": _int(get("users")),
+        "users_max": _int(get("users_max")),
+        "snr_all": snr_all,
+        "snr_hf": snr_hf,
+        "gps_good": _int(get("gps_good")),
+        "fixes_hour": _int(get("fixes_hour")),
+        "uptime": _int(get("uptime")),
+        "adc_ov": _int(get("adc_ov")),
+        "ant_connected": _int(get("ant_connected"), 1),
+        "offline": 1 if get("offline") == "yes" else 0,
+    }
+    for name in string_fields:
+        fields[name] = _text(get(name))
+    return fields
+
+
+# decode the raw objects of a receiver list.  Malformed objects are skipped
+# and reported as (line number, reason) tuples appended to `errors`.  With
+# `lines`, (line number, object) pairs are yielded instead of the objects.
+def iter_objects(path, errors=None, lines=False):
+    if errors is None:
+        errors = []
+    with open(path, "r", encoding="utf-8", errors="replace") as file:
+        buf = ""
+        pos = 0
+        line_base = 1  # line number of buf[0]
+        # line numbers are counted on from the last object yielded
+        counted, counted_line = 0, 1
+        eof = False
+        while True:
+            start = buf.find("{", pos)
+            line_start = buf.rfind("\n", 0, start) + 1
+            if start < 0:
+                if eof:
+                    return
+                # drop consumed text but keep the current partial line
+                line_start = buf.rfind("\n") + 1
+            elif buf[line_start:start].strip():
+                # an object must open its line; braces elsewhere are comments
+                pos = start + 1
+                continue
+            else:
+                # decode a slice ending at the closing brace line; handing the
+                # json scanner the whole buffer makes every error O(buffer)
+                match = _record_end.search(buf, start)
+                if match is None and not eof:
+                    end = None  # record straddles the chunk boundary
+                else:
+                    end = match.end() if match else len(buf)
+                    text = buf[start:end].rstrip().rstrip(",")
+                    if text[:-1].rstrip().endswith(","):
+                        # javascript allows a comma after the last pair
+                        text = _trailing_comma.sub(r"\1", text)
+                    try:
+                        obj = _decode(text)
+                    except ValueError as exc:
+                        obj = f"undecodable record: {exc.msg}"
+                if end is not None:
+                    if isinstance(obj, dict):
+                        if lines:
+                            counted_line += buf.count("\n", counted, start)
+                            counted = start
+                            yield counted_line, obj
+                        else:
+                            yield obj
+                    else:
+                        if not isinstance(obj, str):
+                            obj = "record is not an object"
+                        lineno = line_base + buf.count("\n", 0, start)
+                        errors.append((lineno, obj))
+                    pos = end
+                    continue
+
+            line_base += buf.count("\n", 0, line_start)
+            counted, counted_line = 0, line_base
+            pos = max(pos - line_start, 0)
+            buf = buf[line_start:]
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            buf += chunk
+
+
+# yield typed receiver records from a kiwisdr_com.js style file
+def iter_records(path, errors=None):
+    if errors is None:
+        errors = []
+    for lineno, site in iter_objects(path, errors, lines=True):
+        if not site.get("url"):
+            errors.append((lineno, "record has no url"))
+            continue
+        yield typed_fields(site)
+
+
+if __name__ == "__main__":
+    problems = []
+    count = sum(1 for _ in iter_records(sys.argv[1], problems))
+    print(f"{count} receivers, {len(problems)} malformed records")
+    for lineno, reason in problems:
+        print(f"  line {lineno}: {reason}")
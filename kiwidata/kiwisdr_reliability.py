@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+# Receiver reliability.
+#
+# A receiver's reliability is its availability with exponential decay: a
+# moving average of "up" (1) and "down" (0) over time, where what happened
+# half_life_days ago counts half as much as what happens now.  A receiver
+# is up while it is listed, online and usable, and down while it is offline
+# or missing from the list.
+#
+# Between two changes of state the score simply moves towards the current
+# state, so it is known in closed form at any time from three numbers: the
+# score when the state last changed, the time of that change and the state
+# since.  A refresh only has to touch the receivers whose state changed
+# (and new ones, which start at `prior`); the rest keep their entry as it
+# is.  The state is kept in reliability.json, by receiver id, or by url
+# for receivers without one.
+#
+#   ./kiwisdr_reliability.py [--top N] [snapshot]   print the scores
+
+import json
+import math
+import time
+
+import numpy as np
+from kiwisdr_catalog import usable_mask
+
+reliability_file = "/usr/local/src/kiwidata/reliability.json"
+snapshot_file = "/usr/local/src/kiwidata/kiwisdr_stripped.snap"
+# days for a change of state to count half as much
+half_life_days = 3.0
+# score of a receiver seen for the first time
+prior = 0.5
+# receivers gone from the list are forgotten once their score is this low
+forget_below = 0.001
+
+
+# the key a receiver is tracked by: its id, or its url
+def receiver_keys(snapshot):
+    return [
+        key or url for key, url in zip(snapshot.strings("id"), snapshot.strings("url"))
+    ]
+
+
+def _rate():
+    return math.log(2) / (half_life_days * 86400)
+
+
+# score at `now` of entries [score, since, up], vectorized over arrays
+def _decayed(score, since, up, now):
+    return up + (score - up) * np.exp(-_rate() * np.maximum(now - since, 0))
+
+
+def load_state(path=reliability_file):
+    try:
+        with open(path) as file:
+            state = json.load(file)
+    except (FileNotFoundError, ValueError):
+        state = {}
+    state.setdefault("receivers", {})
+    return state
+
+
+# record the snapshot's receivers in `state` as up or down at `now`; only
+# receivers that changed state, appeared or disappeared are touched.
+# Returns the number of receivers updated.
+def update(state, snapshot, now=None):
+    now = time.time() if now is None else now
+    receivers = state["receivers"]
+    changed = 0
+    listed = set()
+    for key, up in zip(receiver_keys(snapshot), usable_mask(snapshot).tolist()):
+        listed.add(key)
+        entry = receivers.get(key)
+        if entry is None:
+            receivers[key] = [prior, now, int(up)]
+            changed += 1
+        elif entry[2] != up:
+            score = float(_decayed(entry[0], entry[1], entry[2], now))
+            receivers[key] = [score, now, int(up)]
+            changed += 1
+    for key in [key for key in receivers if key not in listed]:
+        score, since, up = receivers[key]
+        if up:
+            # gone from the list: down from now on
+            receivers[key] = [float(_decayed(score, since, up, now)), now, 0]
+            changed += 1
+        elif _decayed(score, since, up, now) < forget_below:
+            del receivers[key]
+    state["time"] = now
+    return changed
+
+
+def dump_state(state):
+    return json.dumps(state, separators=(",", ":"))
+
+
+# reliability of every receiver of the snapshot at `now` (0 to 1; `prior`
+# for receivers not seen before), computed once per snapshot
+def reliability(snapshot, path=reliability_file, now=None):
+    def compute(snapshot):
+        receivers = load_state(path)["receivers"]
+        entries = [receivers.get(key) for key in receiver_keys(snapshot)]
+        default = [prior, 0.0, prior]
+        table = np.array([entry or default for entry in entries], dtype=np.float64)
+        table = table.reshape(-1, 3)
+        when = time.time() if now is None else now
+        return _decayed(table[:, 0], table[:, 1], table[:, 2], when)
+
+    return snapshot.derived(f"reliability {path} {now}", compute)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from kiwisdr_select import top_rows
+    from kiwisdr_snapshot import load_snapshot
+
+    parser = argparse.ArgumentParser(description="Print receiver reliability.")
+    parser.add_argument("snapshot", nargs="?", default=snapshot_file)
+    parser.add_argument("--state", default=reliability_file)
+    parser.add_argument("--top", type=int, default=None, help="best N only")
+    args = parser.parse_args()
+
+    snapshot = load_snapshot(args.snapshot)
+    scores = reliability(snapshot, args.state)
+    urls = snapshot.strings("url")
+    for row in top_rows(scores, args.top):
+        print(f"{scores[row]:6.3f}  {urls[row]}")
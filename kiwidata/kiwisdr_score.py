@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+# Composite receiver score.
+#
+# Each feature below is a column computed from the snapshot, once per
+# snapshot; the score of every receiver is then a single weighted sum over
+# the feature matrix.  The weights live in the "weights" file next to the
+# other data files (feature,weight per line); a feature missing from the
+# file, or weighted 0, does not count.
+#
+#   ./kiwisdr_score.py [--weights FILE] [--top N] [--match TEXT] [snapshot]
+#
+# prints the score of each receiver, best first, broken down by feature.
+
+import csv
+import re
+
+import numpy as np
+from kiwisdr_catalog import snr_values
+from kiwisdr_reliability import reliability
+
+weights_file = "/usr/local/src/kiwidata/weights"
+snapshot_file = "/usr/local/src/kiwidata/kiwisdr_stripped.snap"
+
+
+# SNR over 0-30 MHz, dB; score() can put another figure in its place
+def _snr(snapshot):
+    return snapshot.array("snr_all").astype(np.float64)
+
+
+# share of the receiver's channels that are free, 0 to 1
+def _free_slots(snapshot):
+    users = snapshot.array("users").astype(np.float64)
+    users_max = snapshot.array("users_max").astype(np.float64)
+    free = np.divide(
+        users_max - users, users_max, out=np.zeros_like(users), where=users_max > 0
+    )
+    return np.clip(free, 0, 1)
+
+
+# ADC overloads per hour of uptime, log10(1 + rate): 1 is ~10 per hour
+def _adc_overload(snapshot):
+    hours = np.maximum(snapshot.array("uptime") / 3600, 1)
+    return np.log10(1 + snapshot.array("adc_ov") / hours)
+
+
+# 1 for a GPS disciplined clock: satellites in use and fixes this hour
+def _gps(snapshot):
+    locked = (snapshot.array("gps_good") > 0) & (snapshot.array("fixes_hour") > 0)
+    return locked.astype(np.float64)
+
+
+# 1 when the receiver reports its antenna connected
+def _antenna(snapshot):
+    return (snapshot.array("ant_connected") != 0).astype(np.float64)
+
+
+# days of uptime, log10(1 + days): 1 is ~9 days, 2 is ~3 months
+def _uptime(snapshot):
+    return np.log10(1 + snapshot.array("uptime") / 86400)
+
+
+# 1 when the receiver runs the newest software version of its product line
+# in the list (KiwiSDR_v1.832, Web888_v2025.1117, ...)
+def _current_version(snapshot):
+    values, rows = snapshot.categories("sw_version")
+    versions = []
+    for value in values:
+        match = re.search(r"(\d+)\.(\d+)", value)
+        number = tuple(map(int, match.groups())) if match else (0, 0)
+        versions.append((value.split("_")[0], number))
+    newest = {}
+    for product, number in versions:
+        newest[product] = max(newest.get(product, number), number)
+    current = np.array(
+        [number == newest[product] for product, number in versions], dtype=np.float64
+    )
+    return current[rows] if len(values) else np.zeros(len(snapshot))
+
+
+# availability over the last days, 0 to 1 (see kiwisdr_reliability.py)
+def _reliability(snapshot):
+    return reliability(snapshot)
+
+
+features = {
+    "snr": _snr,
+    "free_slots": _free_slots,
+    "adc_overload": _adc_overload,
+    "gps": _gps,
+    "antenna": _antenna,
+    "uptime": _uptime,
+    "current_version": _current_version,
+    "reliability": _reliability,
+}
+
+
+# {feature: weight} from a weights file
+def load_weights(path=weights_file):
+    weights = {}
+    with open(path, newline="") as file:
+        for row in csv.reader(file):
+            if not row or row[0].lstrip().startswith("#"):
+                continue
+            name, weight = row[0].strip(), float(row[1])
+            if name not in features:
+                raise ValueError(f"{path}: unknown feature {name!r}")
+            weights[name] = weight
+    return weights
+
+
+# one row per feature, one column per receiver; cached with the snapshot
+def feature_matrix(snapshot):
+    def compute(snapshot):
+        return np.vstack([function(snapshot) for function in features.values()])
+
+    return snapshot.derived("score features", compute)
+
+
+def _weight_vector(weights):
+    return np.array([weights.get(name, 0.0) for name in features])
+
+
+# feature_matrix() with the SNR row taken from the `snr` figure of
+# snr_values() instead of the all-band one
+def _features(snapshot, snr):
+    matrix = feature_matrix(snapshot)
+    if snr == "snr_all":
+        return matrix
+    matrix = matrix.copy()
+    matrix[list(features).index("snr")] = snr_values(snapshot, snr)
+    return matrix
+
+
+# composite score of every receiver, its SNR term by the `snr` figure
+def score(snapshot, weights, snr="snr_all"):
+    return _weight_vector(weights) @ _features(snapshot, snr)
+
+
+# weighted contribution of each feature for the given rows: {feature: array}
+def breakdown(snapshot, weights, rows, snr="snr_all"):
+    contributions = _weight_vector(weights)[:, None] * _features(snapshot, snr)[:, rows]
+    return {name: contributions[i] for i, name in enumerate(features)}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from kiwisdr_select import top_rows
+    from kiwisdr_snapshot import load_snapshot
+
+    parser = argparse.ArgumentParser(description="Print receiver score breakdowns.")
+    parser.add_argument("snapshot", nargs="?", default=snapshot_file)
+    parser.add_argument("--weights", default=weights_file)
+    parser.add_argument("--top", type=int, default=None, help="best N only")
+    parser.add_argument("--match", help="receivers whose url or name contain TEXT")
+    args = parser.parse_args()
+
+    snapshot = load_snapshot(args.snapshot)
+    weights = load_weights(args.weights)
+    scores = score(snapshot, weights)
+    rows = top_rows(scores)
+    urls = snapshot.strings("url")
+    if args.match:
+        names = snapshot.strings("name")
+        rows = [
+            row for row in rows if args.match in urls[row] or args.match in names[row]
+        ]
+    rows = np.asarray(rows[: args.top], dtype=np.intp)
+    parts = breakdown(snapshot, weights, rows)
+    shown = [name for name in features if weights.get(name)]
+    print(f"{'score':>8} " + " ".join(f"{name[:12]:>12}" for name in shown) + "  url")
+    for i, row in enumerate(rows):
+        detail = " ".join(f"{parts[name][i]:>12.2f}" for name in shown)
+        print(f"{scores[row]:>8.2f} {detail}  {urls[row]}")
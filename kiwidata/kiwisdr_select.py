@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+# Top-K selection shared by the sorters.
+#
+# Both lists only keep their best few receivers (150 for SuperSDR, 5 per
+# bookmark), so there is no need to sort everything that passed the
+# filters.  Ties are broken by arrival order: of two items with the same
+# key, the one seen first ranks first.  That matches a stable sort, so the
+# output does not depend on how the selection is done.
+#
+# TopK takes items one at a time in O(log K) each, so the best K can be kept
+# while records are still coming out of the parser.  top_rows() does the
+# same on a numpy column with a partition instead of a full sort.
+# capped_rows() walks an ordered list once and keeps it diverse: at most so
+# many items of any one group (site, relay, grid square, ...).
+
+import heapq
+
+
+class TopK:
+    # the `k` items with the largest key(item) seen so far
+
+    def __init__(self, k, key=None):
+        self.k = k
+        self.key = key if key is not None else (lambda item: item)
+        # min-heap of (key, -sequence, item): the root is the item to drop
+        # next, the lowest key and among equal keys the latest arrival
+        self._heap = []
+        self._seen = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, item):
+        entry = (self.key(item), -self._seen, item)
+        self._seen += 1
+        if self.k is None or len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+        elif self.k > 0 and entry[:2] > self._heap[0][:2]:
+            heapq.heapreplace(self._heap, entry)
+
+    def extend(self, items):
+        for item in items:
+            self.push(item)
+        return self
+
+    # the items kept, best first
+    def result(self):
+        return [
+            entry[2] for entry in sorted(self._heap, key=lambda e: e[:2], reverse=True)
+        ]
+
+
+def top_k(items, k, key=None):
+    return TopK(k, key).extend(items).result()
+
+
+# positions of the `k` largest values of a numpy array, best first; equal
+# values keep their order in the array
+def top_rows(values, k=None):
+    import numpy as np
+
+    count = len(values)
+    if k is not None and k < count:
+        if k <= 0:
+            return np.zeros(0, dtype=np.intp)
+        # k-th largest value: everything above it is in, and as many of the
+        # values equal to it as still fit, earliest first
+        threshold = np.partition(values, count - k)[count - k]
+        above = np.flatnonzero(values > threshold)
+        equal = np.flatnonzero(values == threshold)[: k - len(above)]
+        rows = np.concatenate([above, equal])
+    else:
+        rows = np.arange(count)
+    # best value first, then earliest row
+    return rows[np.lexsort((rows, -values[rows].astype(np.float64)))]
+
+
+# the first `k` of `rows` (best first) that stay within group caps.  `caps`
+# is a list of (groups, cap): an array giving the group of every row (-1
+# for none) and how many rows of one group may be taken, or None for no
+# limit.  Greedy in rank order, so a row passed over for one cap does not
+# use up a place under the others.
+def capped_rows(rows, caps, k=None):
+    import numpy as np
+
+    caps = [(groups, cap) for groups, cap in caps if cap is not None]
+    if not caps:
+        return rows[:k]
+    limits = [cap for _, cap in caps]
+    keys = [groups[rows].tolist() for groups, _ in caps]
+    counts = [{} for _ in caps]
+    kept = []
+    for i, row in enumerate(rows.tolist()):
+        if k is not None and len(kept) >= k:
+            break
+        row_keys = [key[i] for key in keys]
+        if any(
+            key >= 0 and count.get(key, 0) >= limit
+            for key, count, limit in zip(row_keys, counts, limits)
+        ):
+            continue
+        for key, count in zip(row_keys, counts):
+            if key >= 0:
+                count[key] = count.get(key, 0) + 1
+        kept.append(row)
+    return np.array(kept, dtype=np.intp)
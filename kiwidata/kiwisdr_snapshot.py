@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+
+# Columnar receiver snapshot.  stripper writes the cleaned receiver list as a
+# compact binary file and the sorters memory-map it, reading only the columns
+# they actually use.  This replaces importing the generated kiwisdr_stripped.py
+# module, which had to be compiled (or unmarshalled) into ~1000 dicts of
+# strings on every refresh.
+#
+# File layout (little endian):
+#   header      magic, format version, record count, generation, column count
+#   directory   one entry per column: name, array typecode, offset, length
+#   data        numeric columns as packed arrays, string columns as uint32
+#               indices into one shared table of interned utf-8 strings
+#
+# Every data block starts on an 8 byte boundary so it can be cast in place.
+
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from kiwisdr_io import atomic_write
+from kiwisdr_parser import string_fields, typed_fields
+
+# default location of the snapshot written by stripper
+snapshot_file = "/usr/local/src/kiwidata/kiwisdr_stripped.snap"
+
+MAGIC = b"KIWISNAP"
+VERSION = 1
+_header = struct.Struct("<8sIIQI")
+_entry = struct.Struct("<24ssxxxxxxxQQ")
+
+# numeric columns and their array typecodes
+NUMERIC_COLUMNS = (
+    ("lat", "d"),
+    ("lon", "d"),
+    ("band_lo", "q"),
+    ("band_hi", "q"),
+    ("freq_offset", "d"),  # kHz, non-zero for converter equipped receivers
+    ("users", "i"),
+    ("users_max", "i"),
+    ("snr_all", "i"),  # first "snr" figure: 0-30 MHz
+    ("snr_hf", "i"),  # second "snr" figure: HF only
+    ("gps_good", "i"),
+    ("fixes_hour", "i"),
+    ("uptime", "q"),
+    ("adc_ov", "q"),
+    ("ant_connected", "b"),
+    ("offline", "b"),
+)
+
+# string columns, stored as indices into the interned string table
+STRING_COLUMNS = string_fields
+
+_STRING_TYPE = "S"
+_TABLE_OFFSETS = "_str_offsets"
+_TABLE_BLOB = "_str_blob"
+
+
+def _pad(length):
+    return -length % 8
+
+
+# serialize typed records (as yielded by kiwisdr_parser) to bytes
+def encode_snapshot(records, generation=0):
+    numeric = {name: array(code) for name, code in NUMERIC_COLUMNS}
+    strings = {name: array("I") for name in STRING_COLUMNS}
+    interned = {}
+    count = 0
+    for record in records:
+        count += 1
+        for name, column in numeric.items():
+            column.append(record[name])
+        for name, column in strings.items():
+            value = record[name]
+            index = interned.get(value)
+            if index is None:
+                index = interned[value] = len(interned)
+            column.append(index)
+
+    offsets = array("I", [0])
+    blob = bytearray()
+    for value in interned:
+        blob += value.encode("utf-8")
+        offsets.append(len(blob))
+
+    blocks = [(name, code, numeric[name]) for name, code in NUMERIC_COLUMNS]
+    blocks += [(name, _STRING_TYPE, strings[name]) for name in STRING_COLUMNS]
+    blocks += [(_TABLE_OFFSETS, "I", offsets), (_TABLE_BLOB, "B", bytes(blob))]
+
+    if sys.byteorder != "little":
+        for _, _, data in blocks:
+            if isinstance(data, array):
+                data.byteswap()
+
+    position = _header.size + _entry.size * len(blocks)
+    position += _pad(position)
+    directory = []
+    payload = []
+    for name, code, data in blocks:
+        raw = data.tobytes() if isinstance(data, array) else data
+        directory.append(_entry.pack(name.encode(), code.encode(), position, len(raw)))
+        payload.append(raw + bytes(_pad(len(raw))))
+        position += len(raw) + _pad(len(raw))
+
+    head = _header.pack(MAGIC, VERSION, count, generation, len(blocks))
+    head += b"".join(directory)
+    head += bytes(_pad(len(head)))
+    return head + b"".join(payload)
+
+
+# True when two encoded snapshots hold the same data (generation aside)
+def same_content(data, other):
+    generation = slice(16, 24)  # offset of the generation in the header
+    return (
+        len(data) == len(other)
+        and data[: generation.start] == other[: generation.start]
+        and data[generation.stop :] == other[generation.stop :]
+    )
+
+
+# write the snapshot next to its final location and rename it into place.
+# A snapshot whose data is unchanged is left alone, so its content hash (and
+# everything built from it) stays the same.  Returns True if it was written.
+def write_snapshot(records, path=snapshot_file, generation=0):
+    data = encode_snapshot(records, generation)
+    try:
+        with open(path, "rb") as file:
+            if same_content(data, file.read()):
+                return False
+    except FileNotFoundError:
+        pass
+    atomic_write(path, data)
+    return True
+
+
+class Snapshot:
+    # read-only view of a snapshot; columns are decoded on first use
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        self._view = memoryview(buffer)
+        magic, version, count, generation, ncols = _header.unpack_from(buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a receiver snapshot (or unsupported version)")
+        self.count = count
+        self.generation = generation
+        self._directory = {}
+        for number in range(ncols):
+            name, code, offset, length = _entry.unpack_from(
+                buffer, _header.size + number * _entry.size
+            )
+            name = name.rstrip(b"\0").decode()
+            self._directory[name] = (code.decode(), offset, length)
+        self._columns = {}
+        self._strings = {}
+        self._table = None
+        self._index = None
+        self._derived = {}
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for view in self._columns.values():
+            view.release()
+        self._columns.clear()
+        self._derived.clear()
+        self._view.release()
+        if isinstance(self._buffer, mmap.mmap):
+            try:
+                self._buffer.close()
+            except BufferError:
+                # numpy views are still alive; the map goes with them
+                pass
+
+    @property
+    def columns(self):
+        return [name for name in self._directory if not name.startswith("_")]
+
+    def _raw(self, name):
+        code, offset, length = self._directory[name]
+        return code, self._view[offset : offset + length]
+
+    # typed memoryview over a numeric column (or the string indices)
+    def column(self, name):
+        view = self._columns.get(name)
+        if view is None:
+            code, raw = self._raw(name)
+            view = raw.cast("I" if code == _STRING_TYPE else code)
+            if sys.byteorder != "little":
+                swapped = array(view.format, view)
+                swapped.byteswap()
+                view = memoryview(swapped)
+            self._columns[name] = view
+        return view
+
+    # numpy view of a column, for the vectorized code paths
+    def array(self, name):
+        import numpy as np
+
+        code, raw = self._raw(name)
+        dtype = "<u4" if code == _STRING_TYPE else "<" + np.dtype(code).str[1:]
+        return np.frombuffer(raw, dtype=dtype)
+
+    def _string_table(self):
+        if self._table is None:
+            offsets = self.column(_TABLE_OFFSETS)
+            _, blob = self._raw(_TABLE_BLOB)
+            blob = bytes(blob)
+            self._table = [
+                blob[offsets[i] : offsets[i + 1]].decode("utf-8")
+                for i in range(len(offsets) - 1)
+            ]
+        return self._table
+
+    # numpy mask of the rows whose string column holds `value`; strings are
+    # interned, so this compares table indices rather than text
+    def equals(self, name, value):
+        import numpy as np
+
+        table = self._string_table()
+        if self._index is None:
+            self._index = {text: i for i, text in enumerate(table)}
+        index = self._index.get(value)
+        if index is None:
+            return np.zeros(self.count, dtype=bool)
+        return self.array(name) == index
+
+    # decoded values of a string column
+    def strings(self, name):
+        values = self._strings.get(name)
+        if values is None:
+            table = self._string_table()
+            values = self._strings[name] = [table[i] for i in self.column(name)]
+        return values
+
+    # distinct values of a string column and, per row, the position of its
+    # value among them
+    def categories(self, name):
+        import numpy as np
+
+        codes, inverse = np.unique(self.array(name), return_inverse=True)
+        table = self._string_table()
+        return [table[code] for code in codes], inverse
+
+    # a column computed from the stored ones by compute(snapshot); computed
+    # on first use and kept for the life of the snapshot
+    def derived(self, name, compute):
+        value = self._derived.get(name)
+        if value is None:
+            value = self._derived[name] = compute(self)
+        return value
+
+    def record(self, index):
+        fields = {}
+        for name, (code, _, _) in self._directory.items():
+            if name.startswith("_"):
+                continue
+            if code == _STRING_TYPE:
+                fields[name] = self.strings(name)[index]
+            else:
+                fields[name] = self.column(name)[index]
+        return fields
+
+    def records(self):
+        for index in range(self.count):
+            yield self.record(index)
+
+
+# open a snapshot file; falls back to the legacy kiwisdr_stripped.py module
+# when no snapshot has been written yet
+def load_snapshot(path=snapshot_file):
+    try:
+        with open(path, "rb") as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        legacy = os.path.join(os.path.dirname(path), "kiwisdr_stripped.py")
+        if not os.path.exists(legacy):
+            raise
+        sys.path.insert(0, os.path.dirname(legacy))
+        from kiwisdr_sources import merge_sources
+        from kiwisdr_stripped import dictlist
+
+        records = (typed_fields(site) for site in dictlist)
+        return Snapshot(
+            encode_snapshot(merge_sources([("kiwisdr_stripped.py", records)]))
+        )
+    return Snapshot(buffer)
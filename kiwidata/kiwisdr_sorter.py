@@ -2,57 +2,95 @@
 
 # This script updates and sorts a list of the KiwiSDRs with the best SNR scored
 # and writes to a list usable for a local html page and SuperSDR.
+# It also writes one such list per band in the bands file, all from a
+# single pass over the receiver data.
 
-from kiwisdr_stripped import dictlist
+import os
+
+from kiwisdr_catalog import band_lists, load_bands, type_mask
+from kiwisdr_filter import FilterError, query
+from kiwisdr_io import atomic_write
+from kiwisdr_score import load_weights, score
+from kiwisdr_snapshot import load_snapshot
 
 # supersdr database
 supersdr_file = "/usr/local/src/kiwidata/kiwiservers"
+# per-band lists, one file per band named after it
+band_dir = "/usr/local/src/kiwidata/servers"
+# bands and their snr and frequency limits (Hz)
+band_file = "/usr/local/src/kiwidata/bands"
+# weights of the composite score the lists are ranked by
+weights_file = "/usr/local/src/kiwidata/weights"
+# receiver snapshot written by stripper
+snapshot_file = "/usr/local/src/kiwidata/kiwisdr_stripped.snap"
 
-# assign freq limits (Hz).  Actual equipment limits may be much more broad.
-freq_range = (100000, 29999999)
+# receivers for the SuperSDR list (syntax in kiwisdr_filter.py): able to
+# tune 100 kHz to 30 MHz, snr above 19 and a free channel.  Running the
+# script with an expression as argument uses that instead.
+server_filter = "covers=100-30000 snr>19 free_slots>0"
 
 listcount = 150
-min_snr = 19
+# rank by the composite score (False: by snr only)
+use_score = True
+# SuperSDR speaks the KiwiSDR protocol: KiwiSDR and Web-888 servers from
+# either list
+server_types = ("kiwi",)
 mykeys = ("url", "loc")
+# most receivers of one site, one relay (proxy.kiwisdr.com, ...), one grid
+# square and one Maidenhead field in a list, so a single busy host or area
+# cannot take out several choices at once; None for no limit
+list_caps = {"host": 2, "front_end": 50, "square": 3, "field": None}
+
+
+# format receivers (snapshot row numbers) as a SuperSDR database
+def server_list(snapshot, rows):
+    # generate an SDR list of locations and urls
+    columns = [snapshot.strings(item) for item in mykeys]
+    sdrlist = ([column[row] for column in columns] for row in rows)
+
+    # build the SuperSDR database
+    payload_3 = '# "description", server:port\n'
+    for element in sdrlist:
+        output = f'"{element[1]}" {element[0]}\n'
+        payload_3 += output
+    return payload_3
+
 
-# pass receivers with a lower limit below our lowest frequency (Hz)
-dictlist = list(
-    filter(
-        lambda site: int(site["bands"].split("-")[0]) < freq_range[0],
-        dictlist,
+# Build the SuperSDR lists from a loaded receiver snapshot and return them
+# as {path: text}; the caller writes them out.  Must not modify the snapshot.
+def build(snapshot):
+    weights = load_weights(weights_file)
+    key = score(snapshot, weights) if use_score else None
+    where = type_mask(snapshot, server_types)
+    # receivers passing the filter, best first, truncated
+    rows = query(
+        snapshot, server_filter, limit=listcount, key=key, where=where, caps=list_caps
     )
-)
-# pass receivers with an upper limit above our highest frequency (Hz)
-dictlist = list(
-    filter(
-        lambda site: int(site["bands"].split("-")[1]) > freq_range[1],
-        dictlist,
+    outputs = {supersdr_file: server_list(snapshot, rows)}
+
+    # the same for every band at once
+    bands = load_bands(band_file)
+    # each band ranked by a score whose SNR term is the band's own figure
+    band_key = (lambda figure: score(snapshot, weights, figure)) if use_score else None
+    lists = band_lists(
+        snapshot, bands, limit=listcount, key=band_key, where=where, caps=list_caps
     )
-)
-
-# filter the list of dictionaries by snr
-dictlist = list(
-    filter(lambda site: int(site["snr"][:2].replace(",", "")) > min_snr, dictlist)
-)
-# exclude sites with no available channels
-dictlist = list(
-    filter(lambda site: float(site["users"]) < float(site["users_max"]), dictlist)
-)
-
-# sort the list of dicts by snr and truncate
-dictlist.sort(key=lambda item: item.get("snr"), reverse=True)
-dictlist = dictlist[0:listcount]
-
-# generate an SDR list of locations and urls
-sdrlist = ([entry.get(item) for item in mykeys] for entry in dictlist)
-
-# build the SuperSDR database
-payload_3 = '# "description", server:port\n'
-for element in sdrlist:
-    output = f'"{element[1]}" {element[0]}\n'
-    payload_3 += output
-
-# Opening a text file in write
-# mode using the open() function
-with open(supersdr_file, "w") as file:
-    file.write(payload_3)
+    for band, rows in lists.items():
+        outputs[f"{band_dir}/{band}"] = server_list(snapshot, rows)
+    return outputs
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1:
+        server_filter = " ".join(sys.argv[1:])
+    os.makedirs(band_dir, exist_ok=True)
+    # write to a temporary file and rename it into place
+    try:
+        outputs = build(load_snapshot(snapshot_file))
+    except FilterError as exc:
+        print(exc, file=sys.stderr)
+        sys.exit(2)
+    for path, text in outputs.items():
+        atomic_write(path, text)
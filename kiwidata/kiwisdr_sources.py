@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+# One receiver catalog from several lists.
+#
+# The KiwiSDR list and the static list (NovaSDR, WebSDR, OpenWebRX, UberSDR
+# and Web-888 receivers kept by hand) are read one after the other and
+# merged into a single stream of typed records.  A receiver is identified
+# by its normalized host:port; the first list naming it wins and later
+# entries for the same host:port are folded into it.  The index is a dict,
+# so merging stays linear in the number of receivers however many lists
+# there are.
+#
+#   ./kiwisdr_sources.py LIST [LIST ...]   print the merge report
+
+import re
+import sys
+from urllib.parse import urlsplit
+
+# receiver software (start of sw_version) and the type of server it is, as
+# used in the stations file and by supersdr-wrapper
+sdr_types = (
+    ("KiwiSDR", "kiwi"),
+    ("Web888", "kiwi"),
+    ("WebSDR", "web"),
+    ("OpenWebRX", "openwebrx"),
+    ("NovaSDR", "phantom"),
+    ("PhantomSDR", "phantom"),
+    ("UberSDR", "uber"),
+)
+default_ports = {"http": 80, "https": 443}
+_host = re.compile(r"[A-Za-z][\w+.-]*://(?:[^@/?#]*@)?(\[[^\]]*\]|[^/?#:]*)")
+# relays carrying many receivers, each under its own subdomain
+# (NAME.proxy.kiwisdr.com); one busy relay affects all of them
+front_ends = ("proxy.kiwisdr.com", "proxy.rx-888.com", "tunnel.ubersdr.org")
+
+
+# "host:port" naming the receiver behind `url`, or "" when it has no host
+def host_key(url):
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").rstrip(".")
+    if not host:
+        return ""
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port is None:
+        port = default_ports.get(parts.scheme.lower(), 0)
+    return f"{host}:{port}"
+
+
+# the site behind `url`: its host name, whatever the port; the channels of
+# a multi-receiver site share it.  A regular expression rather than
+# urlsplit(), as it runs once for every receiver in the list.
+def site_key(url):
+    match = _host.match(url.strip())
+    return match[1].strip("[]").lower().rstrip(".") if match else ""
+
+
+# the relay `url` is reached through, or "" for a direct connection
+def front_end(url, host=None):
+    host = site_key(url) if host is None else host
+    for relay in front_ends:
+        if host.endswith("." + relay):
+            return relay
+    return ""
+
+
+# `url` without query, fragment or trailing slash: the address the wrapper
+# appends its own tuning parameters to
+def base_url(url):
+    parts = urlsplit(url.strip())
+    return f"{parts.scheme}://{parts.netloc}{parts.path}".rstrip("/")
+
+
+def sdr_type(site, default="kiwi"):
+    version = site.get("sw_version", "")
+    for prefix, kind in sdr_types:
+        if version.startswith(prefix):
+            return kind
+    return default
+
+
+# merge typed records from `sources`, a list of (name, records) pairs, in
+# order.  Records gain "source" and "sdr_type" and a normalized url.  The
+# number of records folded into an earlier one is counted per source in
+# `folded`.
+def merge_sources(sources, folded=None):
+    if folded is None:
+        folded = {}
+    seen = {}
+    for name, records in sources:
+        folded.setdefault(name, 0)
+        for site in records:
+            key = host_key(site["url"])
+            if key in seen:
+                folded[name] += 1
+                continue
+            seen[key] = name
+            site["url"] = base_url(site["url"])
+            site["source"] = name
+            site["sdr_type"] = sdr_type(site)
+            yield site
+
+
+if __name__ == "__main__":
+    import os
+
+    from kiwisdr_parser import iter_records
+
+    folded = {}
+    counts = {}
+    sources = [(os.path.basename(path), iter_records(path)) for path in sys.argv[1:]]
+    for site in merge_sources(sources, folded):
+        counts[site["source"]] = counts.get(site["source"], 0) + 1
+    for name in folded:
+        print(f"{name:<24} {counts.get(name, 0):>7} kept {folded[name]:>5} folded")
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+# The sorters as in-process stages.
+#
+# Each sorter script defines build(snapshot), which returns the text of its
+# output file (or {path: text} for several files; the text may also be a
+# generator of lines), and only writes files itself when run as a script.
+# stripper imports the scripts (sdr-stream-bookmarks.py has a hyphen, so by
+# path rather than by name), loads the snapshot once and hands the same
+# read-only object to every stage; kiwisdr_build runs them concurrently.
+#
+#   ./kiwisdr_stages.py [SCRIPT ...]   run stages and print their timings
+
+import importlib.util
+import os
+import sys
+import threading
+import time
+
+from kiwisdr_snapshot import load_snapshot, snapshot_file
+
+stages = ["kiwisdr_sorter.py", "sdr-stream-bookmarks.py"]
+
+
+# import a sorter script as a module
+def load_stage(path):
+    name = os.path.splitext(os.path.basename(path))[0].replace("-", "_")
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    if not callable(getattr(module, "build", None)):
+        raise ImportError(f"{path} has no build(snapshot) function")
+    return module
+
+
+# call `function` on first use only, however many threads ask at once
+def once(function):
+    lock = threading.Lock()
+    result = []
+
+    def call():
+        with lock:
+            if not result:
+                result.append(function())
+        return result[0]
+
+    return call
+
+
+if __name__ == "__main__":
+    from concurrent.futures import ThreadPoolExecutor
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    shared = once(lambda: load_snapshot(snapshot_file))
+
+    def run(script):
+        start = time.perf_counter()
+        output = load_stage(os.path.join(here, script)).build(shared())
+        if not isinstance(output, dict):
+            output = {script: output}
+        # outputs may be generators of lines: count them as they are made
+        size = sum(
+            len(data) if isinstance(data, (str, bytes)) else sum(map(len, data))
+            for data in output.values()
+        )
+        return script, size, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor() as pool:
+        for script, size, seconds in pool.map(run, sys.argv[1:] or stages):
+            print(f"{script:<28} {size:>8} bytes {seconds * 1000:>9.1f} ms")
+    print(f"{'total':<28} {'':>14} {(time.perf_counter() - start) * 1000:>9.1f} ms")
@@ -1,16 +1,65 @@
 #!/usr/bin/env python3
 
 import datetime
+import json
+import os
 import random
+import sys
 
+import numpy as np
 import pandas as pd
-from kiwisdr_stripped import dictlist
+from kiwisdr_catalog import (
+    BandTable,
+    SnrIndex,
+    count_above,
+    coverage_index,
+    diverse,
+    load_bands,
+    open_mask,
+    relaxed_threshold,
+    select,
+    select_mask,
+    snr_values,
+)
+from kiwisdr_filter import compile_filter
+from kiwisdr_io import atomic_write
+from kiwisdr_reliability import reliability, reliability_file
+from kiwisdr_select import top_rows
+from kiwisdr_snapshot import load_snapshot
 
 station_file = "/usr/local/src/kiwidata/stations"
 region_file = "/usr/local/src/kiwidata/regions"
 band_file = "/usr/local/src/kiwidata/bands"
 target_file = "/usr/local/src/kiwidata/sdr-stream-bookmarks"
 raw_serverfile = "/usr/local/src/dyatlov/kiwisdr_com.js"
+snapshot_file = "/usr/local/src/kiwidata/kiwisdr_stripped.snap"
+# extra conditions every automatically chosen server must meet, e.g.
+# 'type=kiwi' or 'hw~"Web-888" uptime>86400' (syntax in kiwisdr_filter.py)
+bookmark_filter = ""
+# adaptive mode: when fewer than relax_target receivers in a region beat
+# the band's snr_limit, the limit is lowered snr_step dB at a time down to
+# snr_floor; if that is still not enough, receivers that only reach the
+# station frequency (e.g. through a converter) count as well.  Bookmarks
+# that needed it are listed in relax_file.  Set relax_target to 0 to keep
+# the band limits as they are.
+relax_target = 3
+snr_step = 3
+snr_floor = 0
+relax_file = "/usr/local/src/kiwidata/sdr-stream-bookmarks.relaxed"
+# stations read from the stations file at a time
+station_chunk = 1000
+# the candidate receivers of each region box and band are worked out once
+# and shared by every station asking for the same; they are kept here for
+# the next run while the receiver snapshot and the settings stay the same
+# ("" to keep them for one run only)
+cache_file = "/usr/local/src/kiwidata/sdr-stream-bookmarks.cache"
+# most receivers of one site, one relay and one grid square among the five a
+# bookmark picks from (see list_caps in kiwisdr_sorter.py); None for no limit
+bookmark_caps = {"host": 1, "front_end": 2, "square": 2, "field": None}
+# receivers that pass the SNR limit are ranked by snr + reliability_weight *
+# reliability (0-1, see kiwisdr_reliability.py), so one that is often down
+# gives way to a steadier one; 0 ranks by snr only
+reliability_weight = 10.0
 
 
 # create dataframes from csv files
@@ -28,7 +77,6 @@ station_cols = [
     "mode",
     "sdrtype",
 ]
-stationdata = csv_to_dataframe(station_file, station_cols)
 
 # Define regiondata and column names
 region_cols = [
@@ -41,18 +89,12 @@ region_cols = [
     "night_freq",
     "utc_offset",
 ]
-regiondata = csv_to_dataframe(region_file, region_cols)
-
-# Define bands and receiver parameters for
-# snr and frequency range per band (kHz):
-band_cols = [
-    "band",
-    "snr_limit",
-    "freq_bot",
-    "freq_top",
-]
-bandparams = csv_to_dataframe(band_file, band_cols)
-bandparams.set_index("band", inplace=True)
+
+# The bands file gives the bands and receiver parameters: band, snr
+# limit, frequency range (Hz) and which snr figure of the list the band is
+# judged by: 0 for the 0-30 MHz one, 1 for the HF one, or a blend in
+# between.  It is read with load_bands() into a BandTable (see
+# kiwisdr_catalog.py).
 
 # filter the list of dictionaries by latitude longitude
 # use geographic boxes bounded by: (south, north, west, east)
@@ -60,9 +102,139 @@ bandparams.set_index("band", inplace=True)
 # time offset from UTC
 
 
-def make_link(dictlist, index, area):
+# rows of the best receivers in a box for a band, after relaxing the band's
+# SNR limit and then its coverage as far as needed to reach relax_target.
+# `indexes` holds the SNR index of every band and frequency asked for so
+# far.  Returns the rows and the (snr_limit, reach) actually used.
+def relaxed_select(
+    snapshot,
+    indexes,
+    freq_range,
+    frequency_hz,
+    min_snr,
+    snr_figure,
+    lat_range,
+    lon_range,
+    where,
+):
+    band_key = (tuple(freq_range), snr_figure)
+    if band_key not in indexes:
+        mask = select_mask(snapshot, freq_range, -np.inf, where=where)
+        indexes[band_key] = SnrIndex(snapshot, mask, snr_figure)
+    rows, snr = indexes[band_key].region(lat_range, lon_range)
+    threshold = relaxed_threshold(snr, min_snr, relax_target, snr_step, snr_floor)
+    reach = "band"
+    if count_above(snr, threshold) < relax_target:
+        frequency_key = (frequency_hz, snr_figure)
+        if frequency_key not in indexes:
+            tunes = coverage_index(snapshot).point(frequency_hz)
+            mask = indexes[band_key].mask | (open_mask(snapshot, where) & tunes)
+            indexes[frequency_key] = SnrIndex(snapshot, mask, snr_figure)
+        wider, wider_snr = indexes[frequency_key].region(lat_range, lon_range)
+        if count_above(wider_snr, threshold) > count_above(snr, threshold):
+            rows, snr, reach = wider, wider_snr, "frequency"
+    return rows[: count_above(snr, threshold)], (threshold, reach)
+
+
+# ranking key of the receivers for a band judged by `snr_figure`
+def ranking_key(snapshot, snr_figure):
+    def compute(snapshot):
+        return snr_values(snapshot, snr_figure) + reliability_weight * reliability(
+            snapshot
+        )
+
+    return snapshot.derived(f"bookmark key {snr_figure} {reliability_weight}", compute)
+
+
+# numpy numbers (from the data files) as plain ones, for json
+def _plain(value):
+    return value.item()
+
+
+class CandidateCache:
+    # ranked candidate lists by query, counting how many were reused (hits)
+    # and how many had to be worked out (misses).  A list that depends on a
+    # detail of the query (the station frequency, when the band alone has
+    # too few receivers) is kept under that detail as well.  `stamp` names
+    # everything the lists depend on besides the query; lists saved under
+    # another stamp are not loaded.
+
+    def __init__(self, stamp, path=""):
+        self.hits = 0
+        self.misses = 0
+        self._stamp = stamp
+        self._lists = {}
+        if path:
+            try:
+                with open(path) as file:
+                    saved = json.load(file)
+            except (FileNotFoundError, ValueError):
+                saved = {}
+            if saved.get("stamp") == stamp:
+                self._lists = {
+                    key: (rows, used if used is None else tuple(used))
+                    for key, (rows, used) in saved["lists"].items()
+                }
+
+    def __len__(self):
+        return len(self._lists)
+
+    # the list for `query`, or compute() -> (rows, used, depends) where
+    # `depends` tells whether the list depends on `detail`
+    def lookup(self, query, detail, compute):
+        key = json.dumps(query, default=_plain)
+        detail_key = json.dumps([query, detail], default=_plain)
+        found = self._lists.get(key) or self._lists.get(detail_key)
+        if found is not None:
+            self.hits += 1
+            return found
+        self.misses += 1
+        rows, used, depends = compute()
+        found = self._lists[detail_key if depends else key] = (rows, used)
+        return found
+
+    def dump(self):
+        lists = {
+            key: ([int(row) for row in rows], used)
+            for key, (rows, used) in self._lists.items()
+        }
+        return json.dumps({"stamp": self._stamp, "lists": lists}, default=_plain)
+
+
+# what the candidate lists depend on besides the query
+def cache_stamp(snapshot):
+    try:
+        state = os.stat(reliability_file).st_mtime_ns
+    except FileNotFoundError:
+        state = 0
+    settings = [bookmark_filter, relax_target, snr_step, snr_floor]
+    return [snapshot.generation, state, settings, bookmark_caps, reliability_weight]
+
+
+def make_link(
+    snapshot,
+    index,
+    area,
+    station,
+    band,
+    min_snr,
+    freq_range,
+    snr_figure,
+    indexes,
+    relaxed,
+    cache,
+):
+    thisregion = station["region"]
+    description = station["description"]
+    url = station["url"]
+    frequency = station["frequency"]
+    mode = station["mode"]
+    sdrtype = station["sdrtype"]
     output = ""
-    if area["region_match"] == thisregion and "kiwi" == sdrtype:
+    kiwi = "kiwi" == sdrtype and freq_range is not None
+    if area["region_match"] == thisregion and kiwi:
+        urls = snapshot.strings("url")
+        types = snapshot.strings("sdr_type")
         # assign lat / lon boundaries
         lat_range = (area["south_latlimit"], area["north_latlimit"])
         lon_range = (area["west_lonlimit"], area["east_lonlimit"])
@@ -74,69 +246,57 @@ def make_link(dictlist, index, area):
         local_freq = area["night_freq"]
         if local_hour >= 7 and local_hour < 18:
             local_freq = area["day_freq"]
-        # filter the list according to lat / lon boundaries
-        dictlist = list(
-            filter(
-                lambda site: float(site["gps"].split(",")[0][1:]) > lat_range[0],
-                dictlist,
-            )
-        )
-        dictlist = list(
-            filter(
-                lambda site: float(site["gps"].split(",")[0][1:]) < lat_range[1],
-                dictlist,
-            )
-        )
-        dictlist = list(
-            filter(
-                lambda site: float(site["gps"].split(",")[1][:-1]) > lon_range[0],
-                dictlist,
-            )
-        )
-        dictlist = list(
-            filter(
-                lambda site: float(site["gps"].split(",")[1][:-1]) < lon_range[1],
-                dictlist,
-            )
-        )
-        # exclude sites with no available channels
-        dictlist = list(
-            filter(
-                lambda site: float(site["users"]) < float(site["users_max"]), dictlist
-            )
-        )
-        # filter the list by frequency range
-        # pass receivers with a lower limit below our lowest frequency (Hz)
-        dictlist = list(
-            filter(
-                lambda site: int(site["bands"].split("-")[0]) < freq_range[0],
-                dictlist,
-            )
-        )
-        # pass receivers with an upper limit above our highest frequency (Hz)
-        dictlist = list(
-            filter(
-                lambda site: int(site["bands"].split("-")[1]) > freq_range[1],
-                dictlist,
-            )
-        )
-        # filter the list by snr
-        dictlist = list(
-            filter(
-                lambda site: int(site["snr"][:2].replace(",", "")) > min_snr, dictlist
+        # filter the list by lat / lon boundaries, free channels, frequency
+        # range and snr, sort by snr and truncate; once per box and band
+        query = [lat_range, lon_range, freq_range, min_snr, snr_figure]
+        frequency_hz = int(frequency) * 1000
+
+        def candidates():
+            where = compile_filter(bookmark_filter).mask(snapshot)
+            key = ranking_key(snapshot, snr_figure) if reliability_weight else None
+            if relax_target <= 0:
+                rows = select(
+                    snapshot,
+                    freq_range,
+                    min_snr,
+                    lat_range,
+                    lon_range,
+                    snr=snr_figure,
+                    limit=listcount,
+                    key=key,
+                    where=where,
+                    caps=bookmark_caps,
+                )
+                return rows, None, False
+            rows, used = relaxed_select(
+                snapshot,
+                indexes,
+                freq_range,
+                frequency_hz,
+                min_snr,
+                snr_figure,
+                lat_range,
+                lon_range,
+                where,
             )
-        )
-        # sort the list of dicts by snr
-        dictlist.sort(key=lambda item: item.get("snr"), reverse=True)
-        # truncate the list
-        dictlist = dictlist[0:listcount]
-        # build the list of servers
-        sdrlist = [entry.get("url") for entry in dictlist]
+            # the station frequency counts only when the band falls short
+            depends = used[1] == "frequency" or len(rows) < relax_target
+            if key is not None:
+                rows = rows[top_rows(key[rows])]
+            return diverse(snapshot, rows, bookmark_caps, listcount), used, depends
+
+        rows, used = cache.lookup(query, frequency_hz, candidates)
+        if used is not None and (used != (min_snr, "band") or not len(rows)):
+            relaxed.append((description, thisregion, band, min_snr, used, rows))
+        # build the list of servers; static receivers (WebSDR, OpenWebRX,
+        # ...) compete with the KiwiSDRs and keep their own server type
+        sdrlist = [(urls[row], types[row]) for row in rows]
         random.shuffle(sdrlist)
         # For the bookmarks, we want only the SDR URL
         try:
+            server, server_type = sdrlist[0]
             output = (
-                f"{description},{band},{sdrlist[0]}/,{frequency},{mode},{sdrtype}\n"
+                f"{description},{band},{server}/,{frequency},{mode},{server_type}\n"
             )
         except Exception:
             # output = f"{description},http://example.com:8073/,{frequency},{mode},{sdrtype}\n"
@@ -164,43 +324,116 @@ def make_link(dictlist, index, area):
         yield
 
 
-out_data = ""
-# Determine required SDR parameters from the station data. For each station,
-# assign minimum snr and frequency range according to the band.
-for index, row in stationdata.iterrows():
-    thisregion = row["region"]
-    description = row["description"]
-    url = row["url"]
-    # get the kHz frequenct and convert to Hz
-    frequency = row["frequency"]
-    frequency_hz = int(f"{frequency}000")
-    mode = row["mode"]
-    sdrtype = row["sdrtype"]
-    # determine band and assign parameters
-    for index, row in bandparams.iterrows():
-        if frequency_hz >= row["freq_bot"] and frequency_hz <= row["freq_top"]:
-            band = index
-            min_snr = row["snr_limit"]
-            # assign min and max frequency parameters for desired band
-            min_hz = int(row["freq_bot"])
-            max_hz = int(row["freq_top"])
+# lines of the relaxation report: which bookmarks got a lower SNR limit or a
+# wider coverage, by how much, and how many receivers they have to pick from;
+# then how many candidate lists of `cache` were reused
+def relax_report(relaxed, cache=None):
+    yield "# bookmark,region,band,snr_limit,snr_used,relaxed_db,reach,receivers\n"
+    # a region made of several boxes reports each box; list equal lines once
+    yield from dict.fromkeys(
+        f"{description},{region},{band},{min_snr},{used},"
+        f"{min_snr - used},{reach},{len(rows)}\n"
+        for description, region, band, min_snr, (used, reach), rows in relaxed
+    )
+    if cache is not None:
+        yield f"# candidate lists: {cache.hits} reused, {cache.misses} computed\n"
+
+
+# (station, band) one at a time, read station_chunk lines at a time, so a
+# long station list is never in memory as a whole.  The band (a load_bands()
+# tuple, or None when the frequency is in none) is looked up for a whole
+# chunk at once.
+def station_records(file, table):
+    chunks = pd.read_csv(file, names=station_cols, header=None, chunksize=station_chunk)
+    for chunk in chunks:
+        # kHz, as in the stations file, to Hz
+        hz = chunk["frequency"].to_numpy(dtype=np.int64) * 1000
+        numbers = table.numbers(hz).tolist()
+        # plain dicts: make_link reads them for every region, and a dict
+        # lookup is far cheaper than a pandas one
+        for station, number in zip(chunk.to_dict("records"), numbers):
+            yield station, table.bands[number] if number >= 0 else None
+
+
+# the bookmark lines, one per station and region found, as they are made;
+# bookmarks that needed relaxing are added to `relaxed`
+def bookmark_lines(snapshot, relaxed, cache):
+    regiondata = csv_to_dataframe(region_file, region_cols).to_dict("records")
+    table = BandTable(load_bands(band_file))
+    for first, second in table.overlaps:
+        print(
+            f"{band_file}: {first} and {second} overlap; {second} wins", file=sys.stderr
+        )
+
+    # per-build state: the SNR index of each band
+    indexes = {}
+    # Determine required SDR parameters from the station data. For each station,
+    # assign minimum snr and frequency range according to the band.
+    for station, params in station_records(station_file, table):
+        if params is None:
+            # no receivers to choose from; bookmarks of other server types
+            # are kept, without a band
+            print(
+                f"{station_file}: {station['description']}: "
+                f"{station['frequency']} kHz is in no band of {band_file}",
+                file=sys.stderr,
+            )
+            band, min_snr, freq_range, snr_figure = "", None, None, 0.0
+        else:
+            band, min_snr, min_hz, max_hz, snr_figure = params
             freq_range = [min_hz, max_hz]
 
-    # For each row in region data, scan the dictionaies for SDRs meeting
-    # geographic bounds, snr score, and other parameters. The generator should
-    # yield a formatted comma separated string for each station bookmark.
-    # Bookmarks will be skipped if no SDRs pass the filters.
-    with open(target_file, "w") as file:
+        # For each row in region data, scan the dictionaies for SDRs meeting
+        # geographic bounds, snr score, and other parameters. The generator should
+        # yield a formatted comma separated string for each station bookmark.
+        # Bookmarks will be skipped if no SDRs pass the filters.
         for item in (
-            make_link(dictlist, index, row) for index, row in regiondata.iterrows()
+            make_link(
+                snapshot,
+                index,
+                row,
+                station,
+                band,
+                min_snr,
+                freq_range,
+                snr_figure,
+                indexes,
+                relaxed,
+                cache,
+            )
+            for index, row in enumerate(regiondata)
         ):
             item = next(item)
-            # Build the bookmarks variable by appending
-            # lines then print it to a file.
-            try:
-                out_data += item
-            except Exception:
-                pass
+            if item:
+                yield item
+
+
+# the candidate cache as text, made when it is written out
+def cache_text(cache):
+    yield cache.dump()
+
+
+# Build the bookmarks from a loaded receiver snapshot and return them (and
+# the relaxation report and candidate cache) as {path: lines}: generators
+# the caller writes out line by line as they are made.  The report and the
+# cache come after the bookmarks, so they are made once all bookmarks are.
+# stripper runs this in-process next to the other sorter, so it must not
+# modify the snapshot or any module state.
+def build(snapshot):
+    relaxed = []
+    # a snapshot not made by stripper (generation 0) may be any snapshot
+    keep = cache_file if snapshot.generation else ""
+    cache = CandidateCache(cache_stamp(snapshot), keep)
+    outputs = {
+        target_file: bookmark_lines(snapshot, relaxed, cache),
+        relax_file: relax_report(relaxed, cache),
+    }
+    if keep:
+        outputs[keep] = cache_text(cache)
+    return outputs
+
 
-        # print(out_data)
-        file.write(out_data)
+if __name__ == "__main__":
+    # stream to temporary files and rename them into place
+    for path, data in build(load_snapshot(snapshot_file)).items():
+        atomic_write(path, data)